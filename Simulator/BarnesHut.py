@@ -0,0 +1,176 @@
+"""
+Barnes-Hut quadtree gravity solver
+
+The tree is stored as flat arrays, and all targets walk it together: every pass keeps a list of
+(target, node) pairs, accepts the nodes that are far enough away as a single point mass and opens
+the rest into their children (or their bodies, for leaves).
+"""
+
+import numpy as np
+
+
+class QuadTree:
+    def __init__(self, pos, mass, leaf_size=8, max_depth=32):
+        self.pos = pos
+        self.mass = mass
+        self.leaf_size = leaf_size
+        self.max_depth = max_depth
+
+        # per node data, filled by build
+        self.size = []
+        self.node_mass = []
+        self.center_of_mass = []
+        self.children = []
+        self.body_start = []
+        self.body_end = []
+        self.order = np.zeros(len(pos), dtype=np.int64)
+        self._next_body = 0
+
+        if len(pos) > 0:
+            low = pos.min(axis=0)
+            high = pos.max(axis=0)
+            center = (low + high) / 2
+            half = max(float((high - low).max()) / 2, 1e-9) * 1.0001
+            self._build(np.arange(len(pos)), center, half, 0)
+
+        self.size = np.array(self.size)
+        self.node_mass = np.array(self.node_mass)
+        self.center_of_mass = np.array(self.center_of_mass).reshape(-1, 2)
+        self.children = np.array(self.children, dtype=np.int64).reshape(-1, 4)
+        self.body_start = np.array(self.body_start, dtype=np.int64)
+        self.body_end = np.array(self.body_end, dtype=np.int64)
+        self.is_leaf = self.body_end > self.body_start
+
+    def _build(self, indices, center, half, depth):
+        node = len(self.size)
+        node_mass = self.mass[indices].sum()
+        if node_mass > 0:
+            com = (self.pos[indices] * self.mass[indices, np.newaxis]).sum(axis=0) / node_mass
+        else:
+            com = self.pos[indices].mean(axis=0)
+        self.size.append(2 * half)
+        self.node_mass.append(node_mass)
+        self.center_of_mass.append(com)
+        self.children.append([-1, -1, -1, -1])
+        self.body_start.append(0)
+        self.body_end.append(0)
+
+        if len(indices) <= self.leaf_size or depth >= self.max_depth:
+            start = self._next_body
+            self.order[start:start + len(indices)] = indices
+            self._next_body += len(indices)
+            self.body_start[node] = start
+            self.body_end[node] = self._next_body
+            return node
+
+        points = self.pos[indices]
+        right = points[:, 0] >= center[0]
+        top = points[:, 1] >= center[1]
+        quadrant = right.astype(np.int64) + 2 * top.astype(np.int64)
+        children = []
+        for q in range(4):
+            child_indices = indices[quadrant == q]
+            if len(child_indices) == 0:
+                children.append(-1)
+                continue
+            offset = np.array([half / 2 if q & 1 else -half / 2, half / 2 if q & 2 else -half / 2])
+            children.append(self._build(child_indices, center + offset, half / 2, depth + 1))
+        self.children[node] = children
+        return node
+
+    def accelerations(self, big_g, theta=0.5, targets=None, softening=0.0, block=4096):
+        target_pos = self.pos if targets is None else self.pos[targets]
+        acceleration = np.zeros((len(target_pos), 2))
+        if len(self.size) == 0:
+            return acceleration
+        # walk the tree for a block of targets at a time so the pair lists stay bounded
+        for start in range(0, len(target_pos), block):
+            end = min(start + block, len(target_pos))
+            acceleration[start:end] = self._walk(target_pos[start:end], theta, softening * softening)
+        acceleration *= big_g
+        return acceleration
+
+    def potentials(self, big_g, theta=0.5, softening=0.0, block=4096):
+        # potential of every body, G * sum of m * ln(distance) over the other bodies
+        potential = np.zeros(len(self.pos))
+        if len(self.size) == 0:
+            return potential
+        for start in range(0, len(self.pos), block):
+            end = min(start + block, len(self.pos))
+            potential[start:end] = self._walk(self.pos[start:end], theta, softening * softening, True)[:, 0]
+        if softening > 0:
+            # the walk also pairs every body with itself
+            potential -= self.mass * np.log(softening * softening) / 2
+        potential *= big_g
+        return potential
+
+    def _walk(self, target_pos, theta, softening_squared, potential=False):
+        # sums accelerations, or with potential the potential into the first column
+        accumulate = self._accumulate_potential if potential else self._accumulate
+        n = len(target_pos)
+        acc_x = np.zeros(n)
+        acc_y = np.zeros(n)
+        target = np.arange(n)
+        node = np.zeros(n, dtype=np.int64)
+        theta_squared = theta * theta
+        while len(target):
+            difference = self.center_of_mass[node] - target_pos[target]
+            square_distance = np.einsum("ij,ij->i", difference, difference)
+            size = self.size[node]
+            opened = size * size >= theta_squared * square_distance
+
+            # far enough away: the whole node acts as one mass at its center of mass
+            accepted = ~opened
+            accumulate(acc_x, acc_y, target[accepted], difference[accepted],
+                             square_distance[accepted] + softening_squared, self.node_mass[node[accepted]])
+
+            # opened leaves: sum their bodies directly
+            leaf = opened & self.is_leaf[node]
+            if leaf.any():
+                leaf_target = target[leaf]
+                leaf_node = node[leaf]
+                counts = self.body_end[leaf_node] - self.body_start[leaf_node]
+                pair_target = np.repeat(leaf_target, counts)
+                first = np.repeat(self.body_start[leaf_node], counts)
+                offsets = np.arange(len(pair_target)) - np.repeat(np.cumsum(counts) - counts, counts)
+                body = self.order[first + offsets]
+                body_difference = self.pos[body] - target_pos[pair_target]
+                body_distance = np.einsum("ij,ij->i", body_difference, body_difference) + softening_squared
+                accumulate(acc_x, acc_y, pair_target, body_difference, body_distance, self.mass[body])
+
+            # opened internal nodes: continue with their children
+            internal = opened & ~self.is_leaf[node]
+            child = self.children[node[internal]].ravel()
+            child_target = np.repeat(target[internal], 4)
+            exists = child >= 0
+            target = child_target[exists]
+            node = child[exists]
+
+        return np.column_stack((acc_x, acc_y))
+
+    @staticmethod
+    def _accumulate(acc_x, acc_y, target, difference, square_distance, mass):
+        if len(target) == 0:
+            return
+        weight = np.divide(mass, square_distance, out=np.zeros_like(square_distance), where=square_distance > 0)
+        acc_x += np.bincount(target, weights=weight * difference[:, 0], minlength=len(acc_x))
+        acc_y += np.bincount(target, weights=weight * difference[:, 1], minlength=len(acc_y))
+
+    @staticmethod
+    def _accumulate_potential(potential, unused, target, difference, square_distance, mass):
+        if len(target) == 0:
+            return
+        log_distance = np.log(square_distance, out=np.zeros_like(square_distance), where=square_distance > 0) / 2
+        potential += np.bincount(target, weights=mass * log_distance, minlength=len(potential))
+
+
+def barnes_hut_accelerations(pos, mass, big_g, theta=0.5, targets=None, softening=0.0, leaf_size=8):
+    tree = QuadTree(pos, mass, leaf_size)
+    return tree.accelerations(big_g, theta, targets, softening)
+
+
+def relative_error(approximate, exact):
+    # per body error of an approximate acceleration, relative to the size of the exact one
+    error = np.linalg.norm(approximate - exact, axis=1)
+    scale = np.linalg.norm(exact, axis=1)
+    return np.divide(error, scale, out=np.zeros_like(error), where=scale > 0)
@@ -0,0 +1,224 @@
+"""
+Benchmark suite
+
+Times the engine step, orbit prediction, path/trail rendering and Vector2 arithmetic, and the fast
+multipole backend's speed and error per expansion order, and writes the results as JSON, so runs on
+different commits can be compared:
+
+    python Benchmark.py --output before.json
+    python Benchmark.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import timeit
+
+import numpy as np
+
+from BarnesHut import barnes_hut_accelerations
+from CelestialBody import CelestialBody
+from FastMultipole import fmm_accelerations
+from Gravity import direct_accelerations
+from Path import CelestialPath
+from Scenario import DISK, PLUMMER, generate
+from SimulationEngine import SimulationEngine, SOLAR
+from Universe import Universe
+from Vector import Vector2
+
+
+class NullDisplay:
+    # the part of Display that SimulationEngine.Update talks to
+    def update(self, time, newBody, steps_per_second=0):
+        pass
+
+    def get_form_text(self, form_name):
+        return ""
+
+
+def random_engine(n, seed=0):
+    rng = random.Random(seed)
+    engine = SimulationEngine(scenario=None)
+    for i in range(n):
+        pos = Vector2(rng.uniform(-1e6, 1e6), rng.uniform(-1e6, 1e6))
+        vel = Vector2(rng.uniform(-1e4, 1e4), rng.uniform(-1e4, 1e4))
+        engine.add_body(CelestialBody(pos, rng.uniform(1, 10), 1, 1, vel, "Body " + str(i), "white"))
+    engine.isPaused = False
+    return engine
+
+
+def measure(function, min_time=0.2, max_calls=1000):
+    # seconds per call, repeating until min_time has passed
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while calls < max_calls and (calls == 0 or elapsed < min_time):
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+    return {"seconds_per_call": elapsed / calls, "calls": calls}
+
+
+def bench_engine(sizes, min_time):
+    results = {}
+    display = NullDisplay()
+    for n in sizes:
+        engine = random_engine(n)
+        results["engine_update_n" + str(n)] = measure(lambda: engine.Update(33, display), min_time)
+    return results
+
+
+def bench_paths(min_time):
+    path = CelestialPath()
+    engine = SimulationEngine(scenario=SOLAR)
+
+    def cold():
+        # forget the cache so the whole 1000 step horizon is integrated again
+        path.cache_key = None
+        path.get_paths(engine, False)
+
+    results = {"get_paths_cold": measure(cold, min_time)}
+    results["get_paths_cached"] = measure(lambda: path.get_paths(engine, False), min_time)
+    return results
+
+
+def bench_fmm(sizes, min_time, orders=(4, 8, 12, 16, 24), samples=500):
+    # speed against accuracy of the fast multipole backend per order, with Barnes-Hut for reference;
+    # errors are relative to the direct sum on a random sample of bodies
+    results = {}
+    for n in sizes:
+        engine = SimulationEngine(scenario=None)
+        generate(engine, DISK, count=n, seed=0)
+        pos, mass = engine.state.pos, engine.state.mass
+        targets = np.random.default_rng(0).choice(n, min(samples, n), replace=False)
+        exact = direct_accelerations(pos, mass, Universe.Big_G, targets, engine.softening)
+        scale = np.linalg.norm(exact, axis=1).mean()
+
+        def accuracy(accelerations):
+            error = np.linalg.norm(accelerations[targets] - exact, axis=1) / scale
+            return {"max_relative_error": float(error.max()), "mean_relative_error": float(error.mean())}
+
+        for order in orders:
+            result = measure(lambda: fmm_accelerations(pos, mass, Universe.Big_G, order, softening=engine.softening),
+                             min_time, 20)
+            result.update(accuracy(fmm_accelerations(pos, mass, Universe.Big_G, order, softening=engine.softening)))
+            results["fmm_order" + str(order) + "_n" + str(n)] = result
+        result = measure(lambda: barnes_hut_accelerations(pos, mass, Universe.Big_G, engine.theta,
+                                                          softening=engine.softening), min_time, 20)
+        result.update(accuracy(barnes_hut_accelerations(pos, mass, Universe.Big_G, engine.theta,
+                                                        softening=engine.softening)))
+        results["barnes_hut_n" + str(n)] = result
+    return results
+
+
+def bench_render(min_time):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame as p
+    from Display import Display
+
+    p.init()
+    screen = p.display.set_mode((1280, 720))
+    display = Display(1280, 720)
+    engine = SimulationEngine(scenario=SOLAR)
+    engine.isPaused = False
+    for _ in range(100):
+        engine.Update(33, NullDisplay())
+    # the prediction runs in a worker process, wait for it before drawing the paths
+    display.update_paths(engine)
+    display.celestial_path.wait()
+    display.update_paths(engine)
+    display.create_ui_objects(engine)
+
+    results = {"draw_stars": measure(lambda: display.draw_stars(screen), min_time),
+               "draw_ui": measure(lambda: display.draw_ui(screen), min_time),
+               "draw_paths": measure(lambda: display.draw_paths(screen, engine), min_time),
+               "draw_trails": measure(lambda: [display.draw_trails(screen, body) for body in engine.bodies], min_time)}
+
+    # 50k bodies zoomed out (all on screen as a heatmap) and zoomed in (few visible circles)
+    cluster = SimulationEngine(scenario=None)
+    generate(cluster, PLUMMER, count=50000, seed=0)
+    display.zoom_level = 0.01
+    results["draw_bodies_n50000_far"] = measure(lambda: display.draw_bodies(screen, cluster), min_time)
+    display.zoom_level = 5
+    results["draw_bodies_n50000_near"] = measure(lambda: display.draw_bodies(screen, cluster), min_time)
+    display.close()
+    p.quit()
+    return results
+
+
+def bench_vector(number=200000):
+    a = Vector2(1.5, -2.5)
+    b = Vector2(0.25, 4.0)
+    statements = {"vector_add": lambda: a + b,
+                  "vector_sub": lambda: a - b,
+                  "vector_mul": lambda: a * 3.0,
+                  "vector_magnitude": lambda: a.magnitude(),
+                  "vector_normalize": lambda: a.normalize()}
+    return {name: {"seconds_per_call": timeit.timeit(statement, number=number) / number, "calls": number}
+            for name, statement in statements.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_all(sizes, min_time, render=True, fmm_sizes=(10000,)):
+    results = {}
+    results.update(bench_engine(sizes, min_time))
+    results.update(bench_paths(min_time))
+    results.update(bench_fmm(fmm_sizes, min_time))
+    if render:
+        results.update(bench_render(min_time))
+    results.update(bench_vector())
+    return {"commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results}
+
+
+def compare(current, previous):
+    print("benchmark                      before        after   ratio")
+    for name, result in current["results"].items():
+        before = previous["results"].get(name)
+        after = result["seconds_per_call"]
+        if before is None:
+            print(f"{name:28s} {'-':>10s} {after:12.3e}")
+        else:
+            print(f"{name:28s} {before['seconds_per_call']:10.3e} {after:12.3e} {after / before['seconds_per_call']:7.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the N-body benchmark suite")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="body counts for the engine step")
+    parser.add_argument("--fmm-sizes", type=int, nargs="+", default=[10000],
+                        help="body counts for the fast multipole speed and accuracy benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds spent on each benchmark")
+    parser.add_argument("--no-render", action="store_true", help="skip the pygame rendering benchmarks")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_all(args.sizes, args.min_time, not args.no_render, args.fmm_sizes)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(report, json.load(file))
+    else:
+        for name, result in report["results"].items():
+            error = f"  max error {result['max_relative_error']:.1e}" if "max_relative_error" in result else ""
+            print(f"{name:28s} {result['seconds_per_call']:.3e} s{error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Hierarchical block timesteps
+
+Every body gets its own timestep, time_step / 2^level. The full step is split into 2^level ticks
+for the deepest level in use; at each tick only the bodies whose own step starts or ends there are kicked, so forces are
+only evaluated for the active bodies. Positions are drifted for everyone on every tick so active
+bodies always see their neighbours where they are. Levels are reassigned at the end of each full
+step, when all bodies are in sync again.
+"""
+
+import numpy as np
+
+
+class BlockTimestepper:
+    def __init__(self, max_level=8, eta=0.01):
+        self.max_level = max_level  # the smallest timestep is time_step / 2^max_level
+        self.eta = eta  # accuracy parameter, fraction of a body's local timescale to step
+        self.levels = None
+        self.acceleration = None
+        # the cached acceleration is only used while the bodies are where and what it was computed for
+        self.cached_pos = None
+        self.force_key = None
+        self.force_evaluations = 0  # number of single body force evaluations done so far
+
+    def reset(self):
+        self.levels = None
+        self.acceleration = None
+        self.cached_pos = None
+        self.force_key = None
+
+    def assign_levels(self, pos, vel, acceleration, time_step):
+        # timescale of each body from its acceleration and the distance to its nearest neighbour
+        n = len(pos)
+        if n < 2:
+            return np.zeros(n, dtype=np.int64)
+        nearest = self.nearest_distances(pos)
+        acceleration_size = np.linalg.norm(acceleration, axis=1)
+        relative_speed = np.linalg.norm(vel - vel.mean(axis=0), axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            timescale = np.minimum(np.sqrt(nearest / acceleration_size), nearest / relative_speed)
+            timescale = np.minimum(timescale, relative_speed / acceleration_size)
+        wanted = self.eta * timescale
+        with np.errstate(divide="ignore"):
+            levels = np.ceil(np.log2(time_step / wanted))
+        levels = np.nan_to_num(levels, nan=0, posinf=self.max_level, neginf=0)
+        return np.clip(levels, 0, self.max_level).astype(np.int64)
+
+    @staticmethod
+    def nearest_distances(pos, block=256):
+        nearest = np.empty(len(pos))
+        for start in range(0, len(pos), block):
+            end = min(start + block, len(pos))
+            difference = pos[np.newaxis, :, :] - pos[start:end, np.newaxis, :]
+            square_distance = np.einsum("ijk,ijk->ij", difference, difference)
+            square_distance[np.arange(end - start), np.arange(start, end)] = np.inf
+            nearest[start:end] = np.sqrt(square_distance.min(axis=1))
+        return nearest
+
+    def step(self, pos, vel, time_step, acceleration_function, force_key=None):
+        # acceleration_function(pos, targets) returns the accelerations of the target bodies only;
+        # force_key stands for whatever else the forces depend on, e.g. backend and softening
+        n = len(pos)
+        if (self.acceleration is None or force_key != self.force_key or self.cached_pos is None
+                or self.cached_pos.shape != pos.shape or not np.array_equal(self.cached_pos, pos)):
+            self.acceleration = acceleration_function(pos, None)
+            self.force_evaluations += n
+            self.levels = None
+            self.force_key = force_key
+        if self.levels is None:
+            self.levels = self.assign_levels(pos, vel, self.acceleration, time_step)
+
+        deepest = int(self.levels.max()) if n else 0
+        ticks = 1 << deepest
+        tick_time = time_step / ticks
+        # number of ticks each body's own step lasts
+        stride = 1 << (deepest - self.levels)
+        body_time_step = stride * tick_time
+
+        for tick in range(ticks):
+            starting = tick % stride == 0
+            vel[starting] += self.acceleration[starting] * (body_time_step[starting, np.newaxis] / 2)
+            pos += vel * tick_time
+            ending = np.flatnonzero((tick + 1) % stride == 0)
+            if len(ending):
+                self.acceleration[ending] = acceleration_function(pos, ending)
+                self.force_evaluations += len(ending)
+                vel[ending] += self.acceleration[ending] * (body_time_step[ending, np.newaxis] / 2)
+
+        self.levels = self.assign_levels(pos, vel, self.acceleration, time_step)
+        self.cached_pos = pos.copy()
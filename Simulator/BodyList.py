@@ -0,0 +1,151 @@
+"""
+Contains class BodyList, the CelestialBody objects of an engine
+
+Bodies loaded in bulk only get a row in the state arrays; their CelestialBody object is created the
+first time something asks for it, so a million body scenario doesn't build a million objects.
+
+Every body also gets an integer id that stays the same while rows are swapped around by removals,
+ids are never reused. Rows and ids map to each other through two arrays, both O(1) lookups.
+"""
+
+import numpy as np
+
+from CelestialBody import CelestialBody
+from Vector import Vector2
+
+DEFAULT_COLOR = "white"
+DEFAULT_SURFACE_GRAVITY = 1
+
+
+class BodyList:
+    def __init__(self, state, trails=None, first_id=0):
+        self.state = state
+        self.trails = trails
+        self._bodies = []  # CelestialBody, or None while it hasn't been created
+        self._info = []  # (name, color, surface gravity) of bodies not created yet, None for the defaults
+        self._ids = np.empty(16, dtype=np.int64)  # row -> id
+        self._rows = np.full(16, -1, dtype=np.int64)  # id - first_id -> row, -1 once removed
+        self.first_id = first_id
+        self.next_id = first_id
+
+    def __len__(self):
+        return len(self._bodies)
+
+    def __iter__(self):
+        for i in range(len(self._bodies)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._bodies)))]
+        if index < 0:
+            index += len(self._bodies)
+        body = self._bodies[index]
+        if body is None:
+            name, color, gravity = self._info[index] or (None, DEFAULT_COLOR, DEFAULT_SURFACE_GRAVITY)
+            body = CelestialBody(Vector2.zero(), 0, gravity, 1, Vector2.zero(),
+                                 name if name is not None else "Body " + str(index), color)
+            body.attach(self.state, index, self.trails)
+            body.id = int(self._ids[index])
+            self._bodies[index] = body
+            self._info[index] = None
+        return body
+
+    def append(self, body):
+        self._bodies.append(body)
+        self._info.append(None)
+        body.id = self._register(1)
+
+    def extend_rows(self, count, names=None, colors=None, surface_gravity=None):
+        # count bodies that already have their rows in the state arrays, created lazily
+        if names is None and colors is None and surface_gravity is None:
+            self._info.extend([None] * count)
+        else:
+            names = names if names is not None else [None] * count
+            colors = colors if colors is not None else [DEFAULT_COLOR] * count
+            surface_gravity = surface_gravity if surface_gravity is not None else [DEFAULT_SURFACE_GRAVITY] * count
+            self._info.extend(zip(names, colors, surface_gravity))
+        self._bodies.extend([None] * count)
+        self._register(count)
+
+    def _register(self, count):
+        # ids for the last count rows, returns the first one
+        end = len(self._bodies)
+        start = end - count
+        first_id = self.next_id
+        self.next_id += count
+        self._ids = _reserve(self._ids, end, 0)
+        self._rows = _reserve(self._rows, self.next_id - self.first_id, -1)
+        self._ids[start:end] = np.arange(first_id, self.next_id)
+        self._rows[first_id - self.first_id:self.next_id - self.first_id] = np.arange(start, end)
+        return first_id
+
+    def id_of(self, index):
+        return int(self._ids[index])
+
+    def ids(self):
+        # id of every row, a view that is only valid until the next add or remove
+        return self._ids[:len(self._bodies)]
+
+    def index_of(self, body_id):
+        # current row of a body, KeyError if it was removed or never existed
+        offset = body_id - self.first_id
+        row = int(self._rows[offset]) if 0 <= offset < self.next_id - self.first_id else -1
+        if row < 0:
+            raise KeyError(body_id)
+        return row
+
+    def get(self, body_id, default=None):
+        try:
+            return self[self.index_of(body_id)]
+        except KeyError:
+            return default
+
+    def __contains__(self, body):
+        body_id = getattr(body, "id", None)
+        return body_id is not None and self.get(body_id) is body
+
+    def swap_remove(self, index):
+        # mirrors BodyState.remove: the last body takes the place of the removed one
+        last = len(self._bodies) - 1
+        self._rows[self._ids[index] - self.first_id] = -1
+        if index != last:
+            self._ids[index] = self._ids[last]
+            self._rows[self._ids[index] - self.first_id] = index
+        last_body = self._bodies.pop()
+        last_info = self._info.pop()
+        if last_body is None and last_info is None:
+            # keep the default name it had in its old row
+            last_info = ("Body " + str(last), DEFAULT_COLOR, DEFAULT_SURFACE_GRAVITY)
+        if index < len(self._bodies):
+            self._bodies[index] = last_body
+            self._info[index] = last_info
+            if last_body is not None:
+                last_body.index = index
+
+    def names(self):
+        return [self._field(i, 0, lambda body: body.name) for i in range(len(self._bodies))]
+
+    def colors(self):
+        return [self._field(i, 1, lambda body: body.color) for i in range(len(self._bodies))]
+
+    def surface_gravity(self):
+        return [self._field(i, 2, lambda body: body.surface_gravity) for i in range(len(self._bodies))]
+
+    def _field(self, index, column, attribute):
+        body = self._bodies[index]
+        if body is not None:
+            return attribute(body)
+        info = self._info[index]
+        if info is None or info[column] is None:
+            return ("Body " + str(index), DEFAULT_COLOR, DEFAULT_SURFACE_GRAVITY)[column]
+        return info[column]
+
+
+def _reserve(array, size, fill):
+    # array with room for at least size entries, doubled so that adding one at a time is amortized O(1)
+    if size <= len(array):
+        return array
+    grown = np.full(max(size, 2 * len(array)), fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
@@ -0,0 +1,102 @@
+"""
+Contains class BodyState, contiguous arrays holding the state of all bodies
+"""
+
+import numpy as np
+
+
+class BodyState:
+    def __init__(self, capacity=16):
+        self.count = 0
+        self.capacity = max(1, capacity)
+        self._pos = np.zeros((self.capacity, 2))
+        self._prev_pos = np.zeros((self.capacity, 2))  # positions before the last step
+        self._vel = np.zeros((self.capacity, 2))
+        self._mass = np.zeros(self.capacity)
+        self._radius = np.zeros(self.capacity)
+
+    # views of the active rows, invalidated when the buffers grow
+    @property
+    def pos(self):
+        return self._pos[:self.count]
+
+    @property
+    def prev_pos(self):
+        return self._prev_pos[:self.count]
+
+    @property
+    def vel(self):
+        return self._vel[:self.count]
+
+    @property
+    def mass(self):
+        return self._mass[:self.count]
+
+    @property
+    def radius(self):
+        return self._radius[:self.count]
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        new_capacity = self.capacity
+        while new_capacity < capacity:
+            new_capacity *= 2
+        self._pos = self._grow(self._pos, new_capacity)
+        self._prev_pos = self._grow(self._prev_pos, new_capacity)
+        self._vel = self._grow(self._vel, new_capacity)
+        self._mass = self._grow(self._mass, new_capacity)
+        self._radius = self._grow(self._radius, new_capacity)
+        self.capacity = new_capacity
+
+    def _grow(self, array, capacity):
+        grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[:self.count] = array[:self.count]
+        return grown
+
+    def add(self, pos, vel, mass, radius):
+        self.reserve(self.count + 1)
+        index = self.count
+        self._pos[index] = pos
+        self._prev_pos[index] = pos
+        self._vel[index] = vel
+        self._mass[index] = mass
+        self._radius[index] = radius
+        self.count += 1
+        return index
+
+    def add_many(self, pos, vel, mass, radius):
+        # appends whole arrays of bodies, returns the index of the first one
+        count = len(pos)
+        self.reserve(self.count + count)
+        start, end = self.count, self.count + count
+        self._pos[start:end] = pos
+        self._prev_pos[start:end] = pos
+        self._vel[start:end] = vel
+        self._mass[start:end] = mass
+        self._radius[start:end] = radius
+        self.count = end
+        return start
+
+    def save_previous(self):
+        self.prev_pos[:] = self.pos
+
+    def interpolated_pos(self, alpha):
+        # positions a fraction alpha of the way from the previous step to the current one
+        if alpha >= 1:
+            return self.pos
+        return self.prev_pos + (self.pos - self.prev_pos) * alpha
+
+    def remove(self, index):
+        # O(1) removal: the last row moves into the gap, returns the index it moved from (None if nothing moved)
+        last = self.count - 1
+        moved = None
+        if index != last:
+            self._pos[index] = self._pos[last]
+            self._prev_pos[index] = self._prev_pos[last]
+            self._vel[index] = self._vel[last]
+            self._mass[index] = self._mass[last]
+            self._radius[index] = self._radius[last]
+            moved = last
+        self.count -= 1
+        return moved
@@ -2,9 +2,10 @@
 Contains class celestialbody
 """
 
+import numpy as np
+
 from Universe import Universe
 from Vector import Vector2
-import pygame as p
 
 
 class NewCelestialBody:
@@ -14,7 +15,7 @@ class NewCelestialBody:
         self.gravity = 1
         self.initial_velocity = Vector2.zero()
         self.name = "Unnamed"
-        self.color = p.Color("white")
+        self.color = "white"
 
     def update(self):
         if self.radius < 1:
@@ -25,29 +26,119 @@ class NewCelestialBody:
 
 class CelestialBody:
     def __init__(self, pos: Vector2, radius, gravity, density, initial_velocity, name, color):
-        self.pos: Vector2 = pos
-        self.radius = radius
+        # until the body is attached to a BodyState it keeps its own values
+        self.state = None
+        self.trails = None
+        self.index = -1
+        self.id = None  # given by the engine's BodyList, unique within the engine and kept after removal
+        self._pos: Vector2 = pos
+        self._velocity: Vector2 = initial_velocity
+        self._radius = radius
         self.surface_gravity = gravity
-        self.velocity = initial_velocity
         self.name = name
         self.color = color
-        self.mass = density * self.surface_gravity * radius * radius / Universe.Big_G
-        self.trail = []  # list of tuples for drawing trails
+        self._mass = density * self.surface_gravity * radius * radius / Universe.Big_G
+        self._trail = []  # trail of a body that isn't attached to an engine yet
+
+    def attach(self, state, index, trails=None):
+        # from here on the body is a view into row index of the state arrays (and trail buffer)
+        self.state = state
+        self.trails = trails
+        self.index = index
+
+    def detach(self):
+        # keep the current values and stop being a view, e.g. when the body is removed from the engine
+        self._pos = self.pos
+        self._velocity = self.velocity
+        self._mass = self.mass
+        self._radius = self.radius
+        self._trail = [Vector2(x, y) for x, y in self.trail.tolist()]
+        self.state = None
+        self.trails = None
+        self.index = -1
+
+    @property
+    def trail(self):
+        # (n, 2) array of trail points, oldest first
+        if self.trails is None:
+            return np.array([point.tuple() for point in self._trail]).reshape(-1, 2)
+        return self.trails.get(self.index)
+
+    @property
+    def pos(self) -> Vector2:
+        if self.state is None:
+            return self._pos
+        x, y = self.state.pos[self.index]
+        return Vector2(float(x), float(y))
+
+    @pos.setter
+    def pos(self, value: Vector2):
+        if self.state is None:
+            self._pos = value
+        else:
+            self.state.pos[self.index] = value.tuple()
+
+    @property
+    def velocity(self) -> Vector2:
+        if self.state is None:
+            return self._velocity
+        x, y = self.state.vel[self.index]
+        return Vector2(float(x), float(y))
+
+    @velocity.setter
+    def velocity(self, value: Vector2):
+        if self.state is None:
+            self._velocity = value
+        else:
+            self.state.vel[self.index] = value.tuple()
+
+    @property
+    def mass(self):
+        if self.state is None:
+            return self._mass
+        return float(self.state.mass[self.index])
+
+    @mass.setter
+    def mass(self, value):
+        if self.state is None:
+            self._mass = value
+        else:
+            self.state.mass[self.index] = value
+
+    @property
+    def radius(self):
+        if self.state is None:
+            return self._radius
+        return float(self.state.radius[self.index])
+
+    @radius.setter
+    def radius(self, value):
+        if self.state is None:
+            self._radius = value
+        else:
+            self.state.radius[self.index] = value
 
     def UpdateVelocity(self, acceleration, time_step):
-        self.velocity += acceleration * time_step
+        self.velocity = self.velocity.scaled_add(acceleration, time_step)
 
     def UpdatePosition(self, time_step):
-        self.pos += self.velocity * time_step
+        self.pos = self.pos.scaled_add(self.velocity, time_step)
         # print(self.name + " position: " + str(self.pos))
+        if self.trails is None:
+            # attached bodies get their trails recorded by the engine
+            self.record_trail()
+
+    def record_trail(self):
         # append a trail
-        self.trail.append(Vector2(self.pos.x, self.pos.y))
-        if len(self.trail) > 100:  # change for longer trails?
-            self.trail.pop(0)
+        pos = self.pos
+        self._trail.append(Vector2(pos.x, pos.y))
+        if len(self._trail) > 100:
+            self._trail.pop(0)
 
     def __eq__(self, other):
+        # names aren't unique, bodies are the same if they have the same id
         if isinstance(other, CelestialBody):
-            return self.name == other.name
+            return self is other or (self.id is not None and self.id == other.id)
         return False
 
     def __str__(self):
@@ -0,0 +1,171 @@
+"""
+Collision detection with a hierarchical spatial hash grid, and momentum conserving mergers
+
+Every octave of body size gets its own uniform grid, with square cells at least as wide as the
+largest diameter in it; the smallest grid's cells are two median radii wide. Two overlapping bodies
+of the same grid are always in the same or in neighbouring cells, and a body overlapping a bigger one
+is in the same or a neighbouring cell of the bigger one's grid. Candidate pairs only come from those
+cells, so the broad phase stays close to linear in the number of bodies however unequal their radii.
+Small systems skip the grids and check every pair at once.
+"""
+
+import numpy as np
+
+# neighbour cells looked at from every cell, half of the 3x3 block so each pair of cells is visited once
+HALF_NEIGHBOURHOOD = ((0, 0), (1, 0), (0, 1), (1, 1), (1, -1))
+# the 3 x 3 block around a cell
+NEIGHBOURHOOD = tuple((dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1))
+# cells from the lower left one of a reach, which spans at most 3 x 3 cells of a bigger grid
+LOOKUP_OFFSETS = tuple((dx, dy) for dy in (0, 1, 2) for dx in (0, 1, 2))
+DIRECT_LIMIT = 256  # fewer bodies than this are checked pair by pair, cheaper than building the grids
+
+
+class SpatialHash:
+    def __init__(self, cell_size=None):
+        self.cell_size = cell_size  # cells of the smallest grid, None picks it from the radii on every query
+
+    def overlapping_pairs(self, pos, radius):
+        # (i, j) index arrays with i < j of all pairs of bodies that touch
+        n = len(pos)
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        if n < 2 or not radius.any():
+            return empty
+        if n < DIRECT_LIMIT:
+            dx = pos[:, 0, np.newaxis] - pos[:, 0]
+            dy = pos[:, 1, np.newaxis] - pos[:, 1]
+            reach = radius[:, np.newaxis] + radius
+            touching = np.triu(dx * dx + dy * dy < reach * reach, 1)
+            if not touching.any():
+                return empty
+            return np.nonzero(touching)
+        base = self.cell_size or 2 * float(np.median(radius)) or 2 * float(radius.max())
+        if base <= 0:
+            return empty
+
+        # grid l has cells of base * 2^l, every body goes into the first one its diameter fits in
+        level = np.maximum(np.ceil(np.log2(np.maximum(2 * radius, 1e-300) / base)), 0).astype(np.int64)
+        level += 2 * radius > base * np.exp2(level)  # rounding of the logarithm
+
+        firsts, seconds = [], []
+        for grid_level in np.flatnonzero(np.bincount(level)).tolist():
+            cell_size = base * 2.0 ** grid_level
+            key = GridKeys(pos, cell_size)
+            members = np.flatnonzero(level == grid_level)
+            cells = key.cells(pos[members])
+            order = np.argsort(key(cells), kind="stable")
+            cells = cells[order]
+            grid = key(cells), members[order]  # sorted cell keys and their bodies
+            # pairs inside the grid, each pair of cells once; in the own cell only with the bodies sorted after
+            for offset in HALF_NEIGHBOURHOOD:
+                self._cell_pairs(key, grid, cells + offset, grid[1], pos, radius, firsts, seconds,
+                                 np.arange(len(members)) if offset == (0, 0) else None)
+
+            # smaller bodies against this grid, in the cells their reach overlaps (up to 3 x 3)
+            smaller = np.flatnonzero(level < grid_level)
+            if len(smaller):
+                # only bodies in or next to an occupied cell can reach into one
+                near = np.sort(np.concatenate([key(cells + offset) for offset in NEIGHBOURHOOD]))
+                centre_keys = key(key.cells(pos[smaller]))
+                found = np.minimum(np.searchsorted(near, centre_keys), len(near) - 1)
+                smaller = smaller[near[found] == centre_keys]
+            if len(smaller):
+                reach = (radius[smaller] + radius[members].max())[:, np.newaxis]
+                low = key.cells(pos[smaller] - reach)
+                high = key.cells(pos[smaller] + reach)
+                # looked up in key order, which binary searches a lot faster than random order
+                order = np.argsort(key(low), kind="stable")
+                smaller, low = smaller[order], low[order]
+                span_x, span_y = (high[order] - low).T
+                for offset in LOOKUP_OFFSETS:
+                    inside = (span_x >= offset[0]) & (span_y >= offset[1])
+                    if inside.any():
+                        self._cell_pairs(key, grid, low[inside] + offset, smaller[inside], pos, radius, firsts, seconds)
+        if not firsts:
+            return empty
+        first = np.concatenate(firsts)
+        second = np.concatenate(seconds)
+        pairs = np.sort(np.minimum(first, second) * n + np.maximum(first, second))
+        # every pair is found once, unless cells were hashed and collided
+        pairs = pairs[np.diff(pairs, prepend=-1) != 0]
+        return pairs // n, pairs % n
+
+    @staticmethod
+    def _cell_pairs(key, grid, query_cells, queries, pos, radius, firsts, seconds, after=None):
+        # appends the pairs of every query body with the touching grid bodies in its query cell;
+        # after[k] limits query k to the grid bodies sorted after position after[k]
+        sorted_keys, sorted_members = grid
+        cell_keys = key(query_cells)
+        low = np.searchsorted(sorted_keys, cell_keys, side="left")
+        high = np.searchsorted(sorted_keys, cell_keys, side="right")
+        if after is not None:
+            low = np.maximum(low, after + 1)
+        counts = np.maximum(high - low, 0)
+        total = int(counts.sum())
+        if total == 0:
+            return
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        first = np.repeat(queries, counts)
+        second = sorted_members[np.repeat(low, counts) + offsets]
+
+        # narrow phase
+        difference = pos[second] - pos[first]
+        touching = np.einsum("ij,ij->i", difference, difference) < (radius[first] + radius[second]) ** 2
+        firsts.append(first[touching])
+        seconds.append(second[touching])
+
+
+class GridKeys:
+    # integer keys of the cells of one grid over the bounding box of pos, row by row so that the keys of a
+    # shifted cell are the keys shifted by a constant and a sorted list of cells stays sorted; grids too
+    # fine for that to fit in 64 bits fall back to hashed cell coordinates, where collisions only add candidates
+
+    def __init__(self, pos, cell_size):
+        self.cell_size = cell_size
+        # a cell of margin on every side for neighbours and reaches
+        self.low = np.floor(pos.min(axis=0) / cell_size).astype(np.int64) - 2
+        high = np.floor(pos.max(axis=0) / cell_size).astype(np.int64) + 2
+        self.stride = int(high[1] - self.low[1]) + 1
+        if (int(high[0] - self.low[0]) + 1) * self.stride >= 1 << 62:
+            self.stride = None
+
+    def cells(self, pos):
+        return np.floor(pos / self.cell_size).astype(np.int64)
+
+    def __call__(self, cells):
+        if self.stride is None:
+            return cells[:, 0] * 73856093 ^ cells[:, 1] * 19349663
+        return (cells[:, 0] - self.low[0]) * self.stride + (cells[:, 1] - self.low[1])
+
+
+def merge_groups(first, second):
+    # joins overlapping pairs into groups of bodies that merge together, as lists of indices
+    parent = {}
+
+    def find(i):
+        root = i
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while parent.get(i, i) != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    for i, j in zip(first.tolist(), second.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = {}
+    for i in parent:
+        groups.setdefault(find(i), []).append(i)
+    for root, group in groups.items():
+        if root not in group:
+            group.append(root)
+    return list(groups.values())
+
+
+def merged_state(pos, vel, mass, radius):
+    # the single body a group turns into: total mass and momentum, mass weighted position, total area
+    total_mass = mass.sum()
+    weights = mass / total_mass if total_mass > 0 else np.full(len(mass), 1 / len(mass))
+    return ((pos * weights[:, np.newaxis]).sum(axis=0), (vel * weights[:, np.newaxis]).sum(axis=0),
+            total_mass, float(np.sqrt((radius * radius).sum())))
@@ -0,0 +1,126 @@
+"""
+Conservation diagnostics
+
+Every interval steps the engine's total kinetic and potential energy, linear and angular momentum
+and the average wall time of a step are sampled. The relative energy drift since the first sample
+shows quickly when a change breaks the physics. Samples are kept in memory for the overlay and can
+be streamed to a CSV or JSON lines file.
+
+The potential energy is an O(N^2) direct sum for small systems and a Barnes-Hut tree sum above
+DIRECT_LIMIT bodies, and is only computed once per interval, so sampling stays cheap next to the
+steps in between.
+"""
+
+import csv
+import json
+from collections import deque
+
+import numpy as np
+
+from BarnesHut import QuadTree
+from Gravity import direct_potential_energy
+from Universe import Universe
+
+DIRECT_LIMIT = 4096  # more bodies than this use the tree for the potential energy
+
+FIELDS = ("step", "time", "bodies", "kinetic", "potential", "total", "energy_drift",
+          "momentum_x", "momentum_y", "angular_momentum", "step_ms")
+
+
+def kinetic_energy(vel, mass):
+    return 0.5 * float(mass @ np.einsum("ij,ij->i", vel, vel))
+
+
+def potential_energy(pos, mass, big_g, softening=0.0, theta=0.5):
+    if len(pos) <= DIRECT_LIMIT:
+        return direct_potential_energy(pos, mass, big_g, softening)
+    # every pair is in both bodies' potentials
+    return 0.5 * float(mass @ QuadTree(pos, mass).potentials(big_g, theta, softening))
+
+
+def linear_momentum(vel, mass):
+    return mass @ vel
+
+
+def angular_momentum(pos, vel, mass):
+    # about the origin, in 2D only the z component exists
+    return float(mass @ (pos[:, 0] * vel[:, 1] - pos[:, 1] * vel[:, 0]))
+
+
+class Diagnostics:
+    def __init__(self, interval=100, history=1000):
+        self.interval = max(1, interval)  # steps between samples
+        self.samples = deque(maxlen=history)
+        self.steps = 0
+        self.step_seconds = 0.0  # wall time of the steps since the last sample
+        self.timed_steps = 0
+        self.initial_energy = None
+        self.bodies_version = None
+        self.file = None
+        self.writer = None
+
+    def record_step(self, engine, seconds):
+        # called by the engine after every step
+        self.steps += 1
+        self.step_seconds += seconds
+        self.timed_steps += 1
+        if self.steps % self.interval == 0:
+            self.sample(engine)
+
+    def sample(self, engine):
+        state = engine.state
+        kinetic = kinetic_energy(state.vel, state.mass)
+        potential = potential_energy(state.pos, state.mass, Universe.Big_G, engine.softening, engine.theta)
+        total = kinetic + potential
+        if self.bodies_version != engine.bodies_version:
+            # adding, removing or merging bodies changes the energy, drift is measured from here on
+            self.bodies_version = engine.bodies_version
+            self.initial_energy = total
+        momentum = linear_momentum(state.vel, state.mass)
+        sample = {"step": self.steps,
+                  "time": engine.sim_time,
+                  "bodies": state.count,
+                  "kinetic": kinetic,
+                  "potential": potential,
+                  "total": total,
+                  "energy_drift": (total - self.initial_energy) / abs(self.initial_energy) if self.initial_energy else 0.0,
+                  "momentum_x": float(momentum[0]) if state.count else 0.0,
+                  "momentum_y": float(momentum[1]) if state.count else 0.0,
+                  "angular_momentum": angular_momentum(state.pos, state.vel, state.mass),
+                  "step_ms": 1000 * self.step_seconds / self.timed_steps if self.timed_steps else 0.0}
+        self.step_seconds = 0.0
+        self.timed_steps = 0
+        self.samples.append(sample)
+        self._write(sample)
+        return sample
+
+    def latest(self):
+        return self.samples[-1] if self.samples else None
+
+    def overlay_text(self):
+        sample = self.latest()
+        if sample is None:
+            return "dE/E: -"
+        return f"dE/E: {sample['energy_drift']:.1e}  L: {sample['angular_momentum']:.3e}  step: {sample['step_ms']:.2f} ms"
+
+    def open_stream(self, path):
+        # .csv gets one row per sample, anything else one JSON object per line
+        self.close()
+        self.file = open(path, "w", newline="")
+        if path.endswith(".csv"):
+            self.writer = csv.DictWriter(self.file, FIELDS)
+            self.writer.writeheader()
+
+    def _write(self, sample):
+        if self.file is None:
+            return
+        if self.writer is not None:
+            self.writer.writerow(sample)
+        else:
+            self.file.write(json.dumps(sample) + "\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.writer = None
@@ -3,22 +3,45 @@ Display engine
 """
 import random
 
+import numpy as np
+
 from Vector import Vector2
 from SimulationEngine import SimulationEngine
 import pygame as p
-from Path import Path, CelestialPath
+from Path import Path, AsyncCelestialPath
 from UI import UI_Object, Button, TextObject, Form
 
 
+# names of the UI objects that only show while the new body panel is open
+NEW_BODY_ELEMENTS = ("Name form", "Gravity form", "Radius form", "Pos form", "PosY form",
+                     "Vel form", "VelY form", "NewBody Button", "New Celestial Body Panel")
+# transparent color of the composited UI surface
+UI_COLORKEY = (255, 0, 255)
+# more changed regions than this are pushed to the screen as their bounding rectangle
+MAX_DIRTY_RECTS = 64
+
 # UI Types
 BUTTON = "button"
 UI = "ui"
 FORM = "form"
 TEXT = "text"
 
+# screen coordinates further out than this are clamped before drawing lines
+POLYLINE_LIMIT = 100000
+# bodies smaller than this many pixels are drawn as points instead of circles
+MIN_CIRCLE_RADIUS = 1.0
+# more sub-pixel bodies than this on screen are drawn as a density heatmap
+POINT_LIMIT = 2000
+HEATMAP_CELL = 2  # pixels per heatmap cell
+HEATMAP_COLOR = (255, 190, 110)
+# steps of the orbit prediction, computed in a worker process and cut short for big systems
+PREDICTION_STEPS = 100000
+# predicted paths are thinned out to about this many points for drawing
+PATH_DRAW_POINTS = 2000
+
 
 class Display:
-    def __init__(self, width, height):
+    def __init__(self, width, height, seed=None):
         self.width = width
         self.height = height
         self.zoom_level = 0.001
@@ -34,21 +57,50 @@ class Display:
         self.show_paths = True
         self.show_new_panel = False
         self.delta_time = 0
-        self.celestial_path = CelestialPath()
+        self.steps_per_second = 0
+        self.celestial_path = AsyncCelestialPath(PREDICTION_STEPS)
+        self.shown_prediction = None  # the celestial_path result self.paths come from
         self.ui_objects: list[UI_Object] = []
         self.ui_layers = 2
-
+        self.profiler = None  # FrameProfiler whose overlay is drawn when it is shown
+        # dirty rectangle mode: present() only pushes the regions drawn this frame and the last one
+        self.dirty_rendering = False
+        self.dirty_rects: list[p.Rect] = []
+        self.previous_rects: list[p.Rect] = []
+        self.full_redraw = True  # the whole screen changed, e.g. the camera moved
+        self.last_view = None
+        self.drawn_since_activity = False
+        self.profiler_font = None
+
+        # UI objects sorted once by what they need every frame, see build_ui_layers
+        self.new_body_ui: list[UI_Object] = []
+        self.new_panel_shown = None
+        self.static_ui: list[UI_Object] = []  # composited into static_ui_surface
+        self.dynamic_ui: list[UI_Object] = []  # text that changes every frame, drawn directly
+        self.forms: dict[str, UI_Object] = {}  # form name -> form
+        self.static_ui_surface = None
+        self.static_ui_key = None
+
+        self.rng = random.Random(seed)
         self.background_stars = []
+        self.star_surface = None  # the background with the stars on it, built on first draw
         self.create_background_stars(500)
 
     def create_background_stars(self, number):
         for i in range(number):
-            self.background_stars.append((random.randint(0, self.width), random.randint(0, self.height)))
+            self.background_stars.append((self.rng.randint(0, self.width), self.rng.randint(0, self.height)))
 
     def create_ui_objects(self, engine: SimulationEngine):
         fps_counter = TextObject("FPS counter", Vector2(self.width - 80, 40), (50, 50), "99", self.get_fps)
         self.ui_objects.append(fps_counter)
 
+        sps_counter = TextObject("SPS counter", Vector2(self.width - 100, 80), (50, 50), "0", self.get_sps)
+        self.ui_objects.append(sps_counter)
+
+        diagnostics = TextObject("Diagnostics", Vector2(self.width - 170, 115), (30, 30), "",
+                                 lambda: self.get_diagnostics(engine))
+        self.ui_objects.append(diagnostics)
+
         new_body_panel = UI_Object("New Celestial Body Panel", Vector2(self.width // 2, 120), (320, 240), color=p.Color("grey4"))
         self.ui_objects.append(new_body_panel)
 
@@ -116,27 +168,48 @@ class Display:
         show_orbits.prompt_text = "Orbits"
         self.ui_objects.append(show_orbits)
 
+        self.build_ui_layers()
+
+    def build_ui_layers(self):
+        # call again after changing ui_objects
+        ordered = [ui for layer in range(self.ui_layers) for ui in self.ui_objects if ui.layer == layer]
+        self.new_body_ui = [ui for ui in self.ui_objects if ui.name in NEW_BODY_ELEMENTS]
+        self.forms = {ui.name: ui for ui in self.ui_objects if ui.type == FORM}
+        self.new_panel_shown = None
+        self.static_ui = [ui for ui in ordered if ui.function is None]
+        self.dynamic_ui = [ui for ui in ordered if ui.function is not None]
+        self.static_ui_key = None
+
     def toggle_show_orbits(self):
         self.show_paths = not self.show_paths
 
     def get_form_text(self, form_name):
-        for ui in self.ui_objects:
-            if ui.type == FORM:
-                if ui.name == form_name:
-                    return ui.saved_text
+        form = self.forms.get(form_name)
+        return form.saved_text if form is not None else None
 
-    def update(self, time, newBody):
+    def update(self, time, newBody, steps_per_second=0):
         self.delta_time = time
+        self.steps_per_second = steps_per_second
         for ui in self.ui_objects:
             ui.update(self.delta_time)
         self.show_new_panel = newBody
 
     def get_fps(self):
-        return "FPS: " + str(1000 // self.delta_time)
+        return "FPS: " + str(1000 // max(self.delta_time, 1))
+
+    def get_sps(self):
+        return "SPS: " + str(self.steps_per_second)
+
+    @staticmethod
+    def get_diagnostics(engine: SimulationEngine):
+        if engine.diagnostics is None:
+            return ""
+        return engine.diagnostics.overlay_text()
 
     def update_paths(self, engine: SimulationEngine):
         if self.show_paths:
-            self.paths = self.celestial_path.get_paths(engine, self.draw_relative_to_body, self.show_new_panel)
+            self.paths = self.celestial_path.get_paths(engine, self.show_new_panel, PATH_DRAW_POINTS)
+            self.shown_prediction = self.celestial_path.result
 
     def world_coordinate_to_screen_pixel(self, pos: Vector2):
         # (0, 0) is in the center of the screen
@@ -149,55 +222,208 @@ class Display:
 
     def draw_simulation(self, screen, engine: SimulationEngine):
         self.move_camera()
+        view = (self.offset.x, self.offset.y, self.zoom_level, self.show_paths, self.draw_relative_to_body)
+        if view != self.last_view:
+            self.last_view = view
+            self.full_redraw = True
+        self.dirty_rects = []
         self.draw_stars(screen)
-        self.draw_paths(screen)
+        self.draw_paths(screen, engine)
         self.draw_bodies(screen, engine)
         self.draw_ui(screen)
+        if self.profiler is not None and self.profiler.show:
+            self.draw_profiler(screen)
+        self.drawn_since_activity = True
+
+    def mark_dirty(self, rect):
+        if self.dirty_rendering and rect is not None:
+            self.dirty_rects.append(rect)
+
+    def present(self):
+        # show the frame, in dirty rectangle mode only the parts that changed
+        if not self.dirty_rendering or self.full_redraw:
+            p.display.flip()
+        else:
+            # what was drawn last frame has to be erased too
+            rects = self.previous_rects + self.dirty_rects
+            if len(rects) > MAX_DIRTY_RECTS:
+                rects = [rects[0].unionall(rects[1:])]
+            if rects:
+                p.display.update(rects)
+        self.previous_rects = self.dirty_rects
+        self.full_redraw = False
+
+    def is_idle(self, engine: SimulationEngine, had_input):
+        # nothing on screen can change: paused, no input and the last frame is already drawn
+        animating = any(getattr(ui, "time_until_not_clicked", 0) > 0 for ui in self.static_ui)
+        # a prediction finished in the worker process since the paths were last updated
+        if self.show_paths:
+            self.celestial_path.poll()
+            animating = animating or self.celestial_path.result is not self.shown_prediction
+        if not engine.isPaused or had_input or animating or self.mouse_down or \
+                self.camera_movement.x != 0 or self.camera_movement.y != 0:
+            self.drawn_since_activity = False
+            return False
+        return self.drawn_since_activity
+
+    def close(self):
+        self.celestial_path.close()
+
+    def draw_profiler(self, screen):
+        if self.profiler_font is None:
+            self.profiler_font = p.font.SysFont("monospace", 14)
+        for i, line in enumerate(self.profiler.overlay_lines()):
+            self.mark_dirty(screen.blit(self.profiler_font.render(line, False, p.Color("white")), (10, 10 + i * 16)))
 
     def draw_stars(self, screen):
-        for star in self.background_stars:
-            screen.set_at(star, p.Color("white"))
+        # also clears the screen, the star surface is opaque
+        if self.star_surface is None:
+            self.star_surface = p.Surface((self.width, self.height))
+            self.star_surface.fill(p.Color("black"))
+            for star in self.background_stars:
+                self.star_surface.set_at(star, p.Color("white"))
+            if p.display.get_surface() is not None:
+                self.star_surface = self.star_surface.convert()
+            self.full_redraw = True
+        screen.blit(self.star_surface, (0, 0))
 
     def draw_ui(self, screen):
-        new_body_elements = ("Name form", "Gravity form", "Radius form", "Pos form", "PosY form",
-                             "Vel form", "VelY form", "NewBody Button", "New Celestial Body Panel")
-        for ui in self.ui_objects:
-            for name in new_body_elements:
-                if ui.name == name:
-                    ui.show = self.show_new_panel
-        for layer in range(self.ui_layers):
-            for ui in self.ui_objects:
-                if ui.show:
-                    if ui.layer == layer:
-                        if ui.function is not None:
-                            ui.do_function()
-                        ui.draw(screen)
-
-    def draw_paths(self, screen):
+        if self.show_new_panel != self.new_panel_shown:
+            self.new_panel_shown = self.show_new_panel
+            for ui in self.new_body_ui:
+                ui.show = self.show_new_panel
+
+        # everything without a text function only changes on input, so it is drawn once into a cached layer
+        key = tuple(ui.render_key() for ui in self.static_ui)
+        if key != self.static_ui_key:
+            self.static_ui_key = key
+            self.static_ui_surface = self.composite_ui(screen)
+            self.full_redraw = True
+        screen.blit(self.static_ui_surface, (0, 0))
+
+        for ui in self.dynamic_ui:
+            if ui.show:
+                ui.do_function()
+                self.mark_dirty(ui.draw(screen))
+
+    def composite_ui(self, screen):
+        surface = p.Surface(screen.get_size())
+        surface.fill(UI_COLORKEY)
+        for ui in self.static_ui:
+            if ui.show:
+                ui.draw(surface)
+        surface.set_colorkey(UI_COLORKEY, p.RLEACCEL)
+        return surface
+
+    def draw_paths(self, screen, engine: SimulationEngine):
         if self.show_paths:
+            # the paths are predicted world positions, relative mode moves them all with the central body,
+            # or with the first body when there is none, so switching never needs a new prediction
+            reference_offset = None
+            reference_index = engine.central_body.index if engine.central_body is not None else 0
+            if self.draw_relative_to_body and reference_index < len(self.paths):
+                reference = self.paths[reference_index].array
+                if reference is not None:
+                    reference_offset = engine.state.pos[reference_index] - reference
             for path in self.paths:
-                length = len(path.points)
-                for i in range(0, length - 1):
-                    start = self.world_coordinate_to_screen_pixel(path.points[i]).tuple()
-                    end = self.world_coordinate_to_screen_pixel(path.points[i + 1]).tuple()
-                    p.draw.line(screen, path.color, start, end, int(8 - (i / length) * 8))
+                points = path.array if path.array is not None else np.array([point.tuple() for point in path.points])
+                length = len(points)
+                if length < 2:
+                    continue
+                if reference_offset is not None:
+                    points = points + reference_offset
+                # paths get thinner towards the end
+                widths = (8 - (np.arange(length - 1) / length) * 8).astype(np.int64)
+                self.draw_polyline(screen, path.color, self.world_coordinates_to_screen_pixels(points), widths)
 
     def draw_bodies(self, screen, engine):
-        for body in engine.bodies:
-            screen_pos = self.world_coordinate_to_screen_pixel(body.pos)
-            radius = body.radius * self.zoom_level * 10
-            p.draw.circle(screen, body.color, screen_pos.tuple(), radius)
+        screen_points = self.world_coordinates_to_screen_pixels(engine.render_positions())
+        radius = engine.state.radius * (self.zoom_level * 10)
+        x = screen_points[:, 0]
+        y = screen_points[:, 1]
+        # only bodies that overlap the screen are drawn at all
+        visible = (x + radius >= 0) & (x - radius <= self.width) & (y + radius >= 0) & (y - radius <= self.height)
+        large = visible & (radius >= MIN_CIRCLE_RADIUS)
+
+        for i in np.flatnonzero(large).tolist():
+            body = engine.bodies[i]
+            self.mark_dirty(p.draw.circle(screen, body.color, (x[i], y[i]), radius[i]))
             self.draw_trails(screen, body)
 
+        points = np.flatnonzero(visible & ~large)
+        if len(points) > POINT_LIMIT:
+            self.draw_heatmap(screen, screen_points[points])
+        elif len(points):
+            pixels = screen_points[points].astype(np.int64)
+            for i, (px, py) in zip(points.tolist(), pixels.tolist()):
+                screen.set_at((px, py), engine.bodies[i].color)
+            low = pixels.min(axis=0)
+            high = pixels.max(axis=0)
+            self.mark_dirty(p.Rect(int(low[0]), int(low[1]), int(high[0] - low[0]) + 1, int(high[1] - low[1]) + 1))
+
+    def draw_heatmap(self, screen, screen_points):
+        # counts per cell, brightness on a log scale so sparse regions stay visible next to dense ones
+        columns = -(-self.width // HEATMAP_CELL)
+        rows = -(-self.height // HEATMAP_CELL)
+        cells = (screen_points // HEATMAP_CELL).astype(np.int64)
+        np.clip(cells[:, 0], 0, columns - 1, out=cells[:, 0])
+        np.clip(cells[:, 1], 0, rows - 1, out=cells[:, 1])
+        counts = np.bincount(cells[:, 0] * rows + cells[:, 1], minlength=columns * rows).reshape(columns, rows)
+        brightness = np.log1p(counts) / np.log1p(counts.max())
+        pixels = (brightness[:, :, np.newaxis] * HEATMAP_COLOR).astype(np.uint8)
+        surface = p.surfarray.make_surface(pixels)
+        if HEATMAP_CELL > 1:
+            surface = p.transform.scale(surface, (columns * HEATMAP_CELL, rows * HEATMAP_CELL))
+        screen.blit(surface, (0, 0), special_flags=p.BLEND_ADD)
+        self.full_redraw = True
+
     def draw_trails(self, screen, body):
-        for i in range(len(body.trail) - 1):
-            start = self.world_coordinate_to_screen_pixel(body.trail[i]).tuple()
-            end = self.world_coordinate_to_screen_pixel(body.trail[i + 1]).tuple()
-            color = p.Color("white") if self.show_paths else body.color
-            p.draw.line(screen, color, start, end, 1)
+        points = body.trail
+        if len(points) < 2:
+            return
+        color = p.Color("white") if self.show_paths else body.color
+        self.draw_polyline(screen, color, self.world_coordinates_to_screen_pixels(points), 1)
+
+    def world_coordinates_to_screen_pixels(self, points):
+        # world_coordinate_to_screen_pixel for an (n, 2) array of points at once
+        screen_points = np.empty_like(points, dtype=np.float64)
+        screen_points[:, 0] = points[:, 0] * self.zoom_level + self.offset.x
+        screen_points[:, 1] = -points[:, 1] * self.zoom_level + self.offset.y
+        return screen_points
+
+    def body_at(self, engine: SimulationEngine, screen_pos, margin=5):
+        # the body drawn closest to a screen position, within margin pixels of its circle, or None
+        if engine.state.count == 0:
+            return None
+        screen_points = self.world_coordinates_to_screen_pixels(engine.render_positions())
+        distance = np.hypot(screen_points[:, 0] - screen_pos[0], screen_points[:, 1] - screen_pos[1])
+        # how far outside its drawn circle the position is
+        distance -= engine.state.radius * (self.zoom_level * 10)
+        closest = int(np.argmin(distance))
+        return engine.bodies[closest] if distance[closest] <= margin else None
+
+    def draw_polyline(self, screen, color, screen_points, widths):
+        # one draw call per run of consecutive on-screen segments with the same width
+        widths = np.broadcast_to(widths, (len(screen_points) - 1,))
+        x = screen_points[:, 0]
+        y = screen_points[:, 1]
+        margin = widths.max(initial=0)
+        off_screen = ((np.maximum(x[:-1], x[1:]) < -margin) | (np.minimum(x[:-1], x[1:]) > self.width + margin) |
+                      (np.maximum(y[:-1], y[1:]) < -margin) | (np.minimum(y[:-1], y[1:]) > self.height + margin))
+        keys = np.where(off_screen, 0, widths)
+        if not keys.any():
+            return
+        # keep far away points in a range pygame can handle
+        screen_points = np.clip(screen_points, -POLYLINE_LIMIT, POLYLINE_LIMIT)
+        run_starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        run_ends = np.append(run_starts[1:], len(keys))
+        for start, end in zip(run_starts.tolist(), run_ends.tolist()):
+            width = int(keys[start])
+            if width > 0:
+                self.mark_dirty(p.draw.lines(screen, color, False, screen_points[start:end + 1].tolist(), width))
 
     def move_camera(self):
-        self.offset += self.camera_movement * self.camera_speed
+        self.offset.scaled_add(self.camera_movement, self.camera_speed)
 
     def camera_drag(self, mouse_pos):
         # ...
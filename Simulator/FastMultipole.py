@@ -0,0 +1,284 @@
+"""
+Fast multipole method for the 2D gravity of this simulation
+
+Positions are complex numbers z = x + iy. The potential of point masses m_j is the real part of
+phi(z) = sum m_j log(z - z_j) and the acceleration at z is a = -G conj(phi'(z)), the same 1/r force
+as the direct sum. The bodies are put in a quadtree whose leaves are all on the same level, deep
+enough that few bodies share a leaf; only boxes that contain bodies are stored, sorted by their
+Morton key, so clustered systems don't fill memory with empty boxes.
+
+    upward      multipole expansions of the leaves (P2M), shifted to their parents (M2M)
+    interaction every box turns the multipoles of its interaction list, the children of its
+                parent's neighbours that aren't its own neighbours, into a local expansion (M2L)
+    downward    local expansions are shifted to the children (L2L) and evaluated in the leaves
+    near field  bodies in neighbouring leaves are summed directly, with softening
+
+Expansion coefficients are stored in units of their box size, so every translation is one of a
+few fixed (order + 1) x (order + 1) matrices, applied to all boxes of a level in one product. The
+cost grows linearly with the number of bodies and with the square of the order, and the error falls
+roughly as 0.5^order. Softening is only applied in the near field; far boxes are at least a leaf
+apart, so leaving it out there costs a relative error of about (softening / leaf size)^2.
+"""
+
+from math import comb
+
+import numpy as np
+
+from Gravity import PAIR_BLOCK, direct_accelerations
+
+ORDER = 16  # terms of the multipole and local expansions
+LEAF_SIZE = 32  # the leaf level is the first where bodies share a leaf with about this many others
+DIRECT_LIMIT = 256  # fewer bodies than this are summed directly
+BITS = 16  # deepest level, box coordinates of the Morton keys have this many bits
+
+# offsets of the 3 x 3 near neighbourhood
+NEIGHBOURS = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+# every offset an interaction list box can have, children of the parent's neighbours that aren't neighbours
+FAR_OFFSETS = [(dx, dy) for dy in range(-3, 4) for dx in range(-3, 4) if abs(dx) > 1 or abs(dy) > 1]
+
+
+def fmm_accelerations(pos, mass, big_g, order=ORDER, targets=None, softening=0.0, leaf_size=LEAF_SIZE):
+    if len(pos) < DIRECT_LIMIT:
+        return direct_accelerations(pos, mass, big_g, targets, softening)
+    tree = FastMultipole(pos, mass, order, leaf_size)
+    return tree.accelerations(big_g, np.arange(len(pos)) if targets is None else np.asarray(targets), softening)
+
+
+class FastMultipole:
+    def __init__(self, pos, mass, order=ORDER, leaf_size=LEAF_SIZE):
+        self.order = order
+        self.mass = mass
+        # work in the unit square
+        low = pos.min(axis=0)
+        self.scale = max(float((pos.max(axis=0) - low).max()), 1e-9) * 1.0001
+        self.z = ((pos[:, 0] - low[0]) + 1j * (pos[:, 1] - low[1])) / self.scale
+
+        cells = 1 << BITS
+        x = np.minimum((self.z.real * cells).astype(np.int64), cells - 1)
+        y = np.minimum((self.z.imag * cells).astype(np.int64), cells - 1)
+        key = interleave(x, y)
+        # bodies sorted by Morton key are sorted by box on every level at once
+        self.sorted_bodies = np.argsort(key, kind="stable")
+        self.sorted_keys = key[self.sorted_bodies]
+        self.levels = self.leaf_level(leaf_size)
+
+        # per level: keys of the boxes with bodies in them, and for every sorted body its box
+        self.keys = {}
+        self.body_box = {}
+        for level in range(2, self.levels + 1):
+            level_keys = self.sorted_keys >> (2 * (BITS - level))
+            new_box = np.diff(level_keys, prepend=-1) != 0
+            self.keys[level] = level_keys[new_box]
+            self.body_box[level] = np.cumsum(new_box) - 1
+        # bodies of leaf b are sorted_bodies[leaf_start[b]:leaf_start[b + 1]]
+        self.leaf_start = np.append(np.flatnonzero(np.diff(self.body_box[self.levels], prepend=-1)), len(key))
+
+        self.multipoles = self.upward()
+        self.locals = self.downward()
+
+    def leaf_level(self, leaf_size):
+        # the first level where the bodies' leaf mates average at most leaf_size, so the near field stays small
+        for level in range(2, BITS + 1):
+            level_keys = self.sorted_keys >> (2 * (BITS - level))
+            counts = np.diff(np.append(np.flatnonzero(np.diff(level_keys, prepend=-1)), len(level_keys)))
+            if float(counts @ counts) <= leaf_size * len(level_keys):
+                return level
+        return BITS
+
+    def centers(self, level):
+        x, y = deinterleave(self.keys[level])
+        return ((x + 0.5) + 1j * (y + 0.5)) / (1 << level)
+
+    def upward(self):
+        # multipole coefficients of the boxes of every level, a_k in units of the box size
+        p = self.order
+        side = 1 << self.levels
+        leaf = self.body_box[self.levels]
+        boxes = len(self.keys[self.levels])
+        difference = (self.z[self.sorted_bodies] - self.centers(self.levels)[leaf]) * side
+        multipole = np.zeros((boxes, p + 1), dtype=np.complex128)
+        multipole[:, 0] = np.bincount(leaf, weights=self.mass[self.sorted_bodies], minlength=boxes)
+        # a_k = -sum m (z - c)^k / k
+        power = self.mass[self.sorted_bodies].astype(np.complex128)
+        for k in range(1, p + 1):
+            power = power * difference
+            multipole[:, k] = -(np.bincount(leaf, weights=power.real, minlength=boxes) +
+                                1j * np.bincount(leaf, weights=power.imag, minlength=boxes)) / k
+
+        multipoles = {self.levels: multipole}
+        for level in range(self.levels - 1, 1, -1):
+            children = self.keys[level + 1]
+            parent = np.searchsorted(self.keys[level], children >> 2)
+            multipole = np.zeros((len(self.keys[level]), p + 1), dtype=np.complex128)
+            for quadrant, translation in enumerate(_child_to_parent(p)):
+                # no parent has two children in the same quadrant, so plain indexing adds them up
+                child = (children & 3) == quadrant
+                multipole[parent[child]] += multipoles[level + 1][child] @ translation.T
+            multipoles[level] = multipole
+        return multipoles
+
+    def downward(self):
+        # local expansions of the leaves, b_l in units of the leaf size
+        p = self.order
+        local = None
+        far = _far_translations(p)
+        for level in range(2, self.levels + 1):
+            keys = self.keys[level]
+            boxes = np.zeros((len(keys), p + 1), dtype=np.complex128)
+            if local is not None:
+                parent = np.searchsorted(self.keys[level - 1], keys >> 2)
+                for quadrant, translation in enumerate(_parent_to_child(p)):
+                    child = (keys & 3) == quadrant
+                    boxes[child] = local[parent[child]] @ translation.T
+            local = boxes
+
+            x, y = deinterleave(keys)
+            side = 1 << level
+            multipole = self.multipoles[level]
+            for (dx, dy), translation in zip(FAR_OFFSETS, far):
+                # only boxes whose parent neighbours the source's parent have it in their interaction list
+                valid = ((x & 1) + dx >= -2) & ((x & 1) + dx <= 3) & ((y & 1) + dy >= -2) & ((y & 1) + dy <= 3)
+                valid &= (x + dx >= 0) & (x + dx < side) & (y + dy >= 0) & (y + dy < side)
+                target = np.flatnonzero(valid)
+                source, found = _lookup(keys, interleave(x[target] + dx, y[target] + dy))
+                target = target[found]
+                if len(target):
+                    local[target] += multipole[source[found]] @ translation.T
+        return local
+
+    def accelerations(self, big_g, targets, softening=0.0):
+        # accelerations of the bodies with the given indices
+        rank = np.empty(len(self.z), dtype=np.int64)
+        rank[self.sorted_bodies] = np.arange(len(self.z))
+        leaf = self.body_box[self.levels][rank[targets]]
+        side = 1 << self.levels
+        z = self.z[targets]
+        difference = (z - self.centers(self.levels)[leaf]) * side
+        # far field: phi'(z) = sum l b_l (z - c)^(l - 1), with z - c and b_l in leaf size units
+        derivative = np.zeros(len(z), dtype=np.complex128)
+        for l in range(self.order, 0, -1):
+            derivative = derivative * difference + l * self.locals[leaf, l]
+        acceleration = -np.conj(derivative * side)
+        acceleration += self.near_field(z, leaf, softening / self.scale)
+        # positions were divided by scale, so was every distance
+        acceleration *= big_g / self.scale
+        return np.column_stack((acceleration.real, acceleration.imag))
+
+    def near_field(self, z, leaf, softening):
+        # direct sum over the bodies of the 3 x 3 leaves around every target's leaf
+        side = 1 << self.levels
+        keys = self.keys[self.levels]
+        x, y = deinterleave(keys[leaf])
+        neighbours = np.full((len(z), len(NEIGHBOURS)), -1, dtype=np.int64)
+        for column, (dx, dy) in enumerate(NEIGHBOURS):
+            inside = np.flatnonzero((x + dx >= 0) & (x + dx < side) & (y + dy >= 0) & (y + dy < side))
+            box, found = _lookup(keys, interleave(x[inside] + dx, y[inside] + dy))
+            neighbours[inside[found], column] = box[found]
+        counts = np.where(neighbours >= 0, self.leaf_start[neighbours + 1] - self.leaf_start[np.maximum(neighbours, 0)], 0)
+
+        acceleration = np.zeros(len(z), dtype=np.complex128)
+        pairs = np.cumsum(counts.sum(axis=1))
+        first = 0
+        while first < len(z):
+            # as many targets as fit in one block of pairs
+            last = max(first + 1, int(np.searchsorted(pairs, (pairs[first - 1] if first else 0) + PAIR_BLOCK)))
+            block_counts = counts[first:last].ravel()
+            pair_target = np.repeat(np.repeat(np.arange(last - first), len(NEIGHBOURS)), block_counts)
+            group_start = np.repeat(self.leaf_start[np.maximum(neighbours[first:last].ravel(), 0)], block_counts)
+            offsets = np.arange(len(pair_target)) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+            source = self.sorted_bodies[group_start + offsets]
+            difference = self.z[source] - z[first + pair_target]
+            square_distance = difference.real * difference.real + difference.imag * difference.imag + softening * softening
+            # a body does not pull on itself
+            weight = np.divide(self.mass[source], square_distance, out=np.zeros_like(square_distance),
+                               where=square_distance > 0)
+            acceleration[first:last] += (np.bincount(pair_target, weights=weight * difference.real, minlength=last - first) +
+                                         1j * np.bincount(pair_target, weights=weight * difference.imag, minlength=last - first))
+            first = last
+        return acceleration
+
+
+def interleave(x, y):
+    # Morton key, x in the even bits and y in the odd bits
+    return _spread(x) | (_spread(y) << 1)
+
+
+def deinterleave(key):
+    return _compact(key), _compact(key >> 1)
+
+
+def _spread(value):
+    value = value & 0xFFFF
+    value = (value | (value << 8)) & 0x00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F
+    value = (value | (value << 2)) & 0x33333333
+    return (value | (value << 1)) & 0x55555555
+
+
+def _compact(key):
+    value = key & 0x55555555
+    value = (value | (value >> 1)) & 0x33333333
+    value = (value | (value >> 2)) & 0x0F0F0F0F
+    value = (value | (value >> 4)) & 0x00FF00FF
+    return (value | (value >> 8)) & 0xFFFF
+
+
+def _lookup(keys, wanted):
+    # positions of wanted in the sorted keys, and which of them are there
+    index = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    return index, keys[index] == wanted
+
+
+def multipole_shift(shift, p):
+    # M2M: multipole coefficients about a new center, shift = old center - new center
+    matrix = np.zeros((p + 1, p + 1), dtype=np.complex128)
+    matrix[0, 0] = 1
+    for l in range(1, p + 1):
+        matrix[l, 0] = -shift ** l / l
+        for k in range(1, l + 1):
+            matrix[l, k] = comb(l - 1, k - 1) * shift ** (l - k)
+    return matrix
+
+
+def multipole_to_local(shift, p):
+    # M2L: local coefficients about a center from a multipole about center + shift, far apart
+    matrix = np.zeros((p + 1, p + 1), dtype=np.complex128)
+    matrix[0, 0] = np.log(-shift)
+    for k in range(1, p + 1):
+        matrix[0, k] = (-1) ** k / shift ** k
+    for l in range(1, p + 1):
+        matrix[l, 0] = -1 / (l * shift ** l)
+        for k in range(1, p + 1):
+            matrix[l, k] = (-1) ** k * comb(l + k - 1, k - 1) / shift ** (l + k)
+    return matrix
+
+
+def local_shift(shift, p):
+    # L2L: local coefficients about a new center, shift = old center - new center
+    matrix = np.zeros((p + 1, p + 1), dtype=np.complex128)
+    for l in range(p + 1):
+        for k in range(l, p + 1):
+            matrix[l, k] = comb(k, l) * (-shift) ** (k - l)
+    return matrix
+
+
+def _quadrant_offset(quadrant):
+    # child center minus parent center for a Morton quadrant, in parent box sizes
+    return ((quadrant & 1) - 0.5 + 1j * ((quadrant >> 1) - 0.5)) / 2
+
+
+def _child_to_parent(p):
+    # M2M for each quadrant, from child box units to parent box units
+    halves = np.diag(0.5 ** np.arange(p + 1))
+    return [multipole_shift(_quadrant_offset(quadrant), p) @ halves for quadrant in range(4)]
+
+
+def _parent_to_child(p):
+    # L2L for each quadrant, from parent box units to child box units
+    halves = np.diag(0.5 ** np.arange(p + 1))
+    return [halves @ local_shift(-_quadrant_offset(quadrant), p) for quadrant in range(4)]
+
+
+def _far_translations(p):
+    # M2L for each interaction list offset, in box units of the level
+    return [multipole_to_local(dx + 1j * dy, p) for dx, dy in FAR_OFFSETS]
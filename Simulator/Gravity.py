@@ -0,0 +1,59 @@
+"""
+Batched gravity calculations on arrays of positions and masses
+"""
+
+import numpy as np
+
+# upper bound for the number of pair entries evaluated at once, small blocks stay in cache and keep memory flat
+PAIR_BLOCK = 1 << 18
+
+
+def direct_accelerations(pos, mass, big_g, targets=None, softening=0.0):
+    # acceleration of each target from every body, a = G * m * direction * distance / (distance^2 + softening^2)
+    target_pos = pos if targets is None else pos[targets]
+    acceleration = np.zeros_like(target_pos)
+    n = len(pos)
+    if n == 0 or len(target_pos) == 0:
+        return acceleration
+
+    x = pos[:, 0]
+    y = pos[:, 1]
+    chunk = max(1, PAIR_BLOCK // n)
+    for start in range(0, len(target_pos), chunk):
+        end = min(start + chunk, len(target_pos))
+        dx = x[np.newaxis, :] - target_pos[start:end, 0, np.newaxis]
+        dy = y[np.newaxis, :] - target_pos[start:end, 1, np.newaxis]
+        square_distance = dx * dx
+        square_distance += dy * dy
+        square_distance += softening * softening
+        # a body does not pull on itself (or, unsoftened, on anything sitting exactly on top of it)
+        weight = np.divide(mass, square_distance, out=np.zeros_like(square_distance), where=square_distance > 0)
+        acceleration[start:end, 0] = np.einsum("ij,ij->i", weight, dx)
+        acceleration[start:end, 1] = np.einsum("ij,ij->i", weight, dy)
+
+    acceleration *= big_g
+    return acceleration
+
+
+def direct_potential_energy(pos, mass, big_g, softening=0.0):
+    # total potential energy G * sum over pairs of m_i * m_j * ln(distance), softened like the force
+    n = len(pos)
+    if n < 2:
+        return 0.0
+    x = pos[:, 0]
+    y = pos[:, 1]
+    total = 0.0
+    chunk = max(1, PAIR_BLOCK // n)
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        dx = x[np.newaxis, :] - x[start:end, np.newaxis]
+        dy = y[np.newaxis, :] - y[start:end, np.newaxis]
+        square_distance = dx * dx
+        square_distance += dy * dy
+        square_distance += softening * softening
+        # leave out every body paired with itself, ln(1) = 0
+        square_distance[np.arange(end - start), np.arange(start, end)] = 1
+        log_distance = np.log(square_distance, out=np.zeros_like(square_distance), where=square_distance > 0)
+        total += float(mass[start:end] @ (log_distance @ mass))
+    # every pair was counted twice, and ln(distance) is half of ln(distance^2)
+    return big_g * total / 4
@@ -0,0 +1,168 @@
+"""
+Headless batch runner
+
+Advances a SimulationEngine for a number of steps without any display, UI or frame rate cap and
+writes the results to a file. Runs anywhere numpy does, e.g.
+
+    python Headless.py --scenario solar --steps 100000 --dt 0.01 --record-every 100 --output run.npz
+
+or replays a session recorded by Main (see Recording) at full speed, e.g. to profile it:
+
+    python Headless.py --replay session.jsonl --output replayed.npz
+"""
+
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from Diagnostics import Diagnostics
+from FastMultipole import ORDER
+from Integrator import INTEGRATORS
+from Recording import replay
+from Snapshot import TrajectoryWriter, save_checkpoint, restore_checkpoint
+from Scenario import PLUMMER, DISK, CLUSTER, generate
+from SimulationEngine import SimulationEngine, DIRECT, BARNES_HUT, PARALLEL, FMM, BINARY, SOLAR
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the N-body simulation without a display")
+    parser.add_argument("--scenario", default=BINARY,
+                        help="initial conditions: " + ", ".join((BINARY, SOLAR, PLUMMER, DISK, CLUSTER)) + " or a scenario file")
+    parser.add_argument("--bodies", type=int, default=1000, help="number of bodies for the generated scenarios")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for the generated scenarios")
+    parser.add_argument("--steps", type=int, default=1000, help="number of steps to simulate")
+    parser.add_argument("--dt", type=float, default=0.033, help="simulation time per step")
+    parser.add_argument("--backend", default=DIRECT, choices=(DIRECT, BARNES_HUT, PARALLEL, FMM),
+                        help="force backend")
+    parser.add_argument("--workers", type=int, default=None, help="processes for the parallel backend (default: all cores)")
+    parser.add_argument("--integrator", default="euler", choices=tuple(INTEGRATORS), help="time integrator")
+    parser.add_argument("--block-timesteps", action="store_true", help="give every body its own power of two timestep")
+    parser.add_argument("--no-collisions", action="store_true",
+                        help="let bodies pass through each other instead of merging, keeps the body count fixed; "
+                             "always the case while frames are recorded")
+    parser.add_argument("--theta", type=float, default=0.5, help="Barnes-Hut opening angle")
+    parser.add_argument("--fmm-order", type=int, default=ORDER, help="terms of the fast multipole expansions")
+    parser.add_argument("--record-every", type=int, default=0,
+                        help="store a frame every this many steps (0 stores only the final state)")
+    parser.add_argument("--output", default="output.npz", help="result file, .npz for frames or .csv for the final state")
+    parser.add_argument("--trajectory", help="also append every recorded frame to this binary trajectory file")
+    parser.add_argument("--checkpoint", help="checkpoint file written every --checkpoint-every steps and at the end")
+    parser.add_argument("--checkpoint-every", type=int, default=0)
+    parser.add_argument("--resume", help="start from this checkpoint instead of the scenario")
+    parser.add_argument("--diagnostics", help="stream energy and momentum samples to this .csv or JSON lines file")
+    parser.add_argument("--diagnostics-every", type=int, default=100, help="steps between diagnostics samples")
+    parser.add_argument("--replay", help="replay a recorded session instead, the run options above are ignored")
+    return parser.parse_args(argv)
+
+
+def run(engine: SimulationEngine, steps, dt, record_every=0, trajectory=None, checkpoint=None, checkpoint_every=0):
+    # returns the recorded frames as (times, positions, velocities), the body count must not change while recording
+    if engine.collisions and (record_every or trajectory is not None):
+        raise ValueError("Recording frames needs collisions turned off, merging bodies changes the body count")
+    times, positions, velocities = [], [], []
+    for step in range(1, steps + 1):
+        engine.advance(dt)
+        if record_every and step % record_every == 0:
+            times.append(engine.sim_time)
+            positions.append(engine.state.pos.copy())
+            velocities.append(engine.state.vel.copy())
+            if trajectory is not None:
+                trajectory.append(engine)
+        if checkpoint and checkpoint_every and step % checkpoint_every == 0:
+            save_checkpoint(checkpoint, engine)
+    if not times or times[-1] != engine.sim_time:
+        times.append(engine.sim_time)
+        positions.append(engine.state.pos.copy())
+        velocities.append(engine.state.vel.copy())
+    if checkpoint:
+        save_checkpoint(checkpoint, engine)
+    return np.array(times), np.array(positions), np.array(velocities)
+
+
+def write_npz(path, engine, times, positions, velocities):
+    np.savez(path, time=times, pos=positions, vel=velocities,
+             mass=engine.state.mass, radius=engine.state.radius,
+             name=np.array(engine.bodies.names()))
+
+
+def write_csv(path, engine):
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(("name", "x", "y", "vx", "vy", "mass", "radius"))
+        for name, pos, vel, mass, radius in zip(engine.bodies.names(), engine.state.pos.tolist(), engine.state.vel.tolist(),
+                                                engine.state.mass.tolist(), engine.state.radius.tolist()):
+            writer.writerow((name, pos[0], pos[1], vel[0], vel[1], mass, radius))
+
+
+def main_replay(args):
+    engine = SimulationEngine(scenario=None)
+    engine.record_trails = False
+    start = time.perf_counter()
+    try:
+        frames = replay(args.replay, engine)
+    finally:
+        engine.close()
+    elapsed = time.perf_counter() - start
+    if args.output.endswith(".csv"):
+        write_csv(args.output, engine)
+    else:
+        write_npz(args.output, engine, np.array([engine.sim_time]), engine.state.pos[np.newaxis], engine.state.vel[np.newaxis])
+    print("Replayed", frames, "frames of", len(engine.bodies), "bodies in", round(elapsed, 3), "s")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.replay:
+        main_replay(args)
+        return
+    if args.scenario in (PLUMMER, DISK, CLUSTER):
+        engine = SimulationEngine(scenario=None)
+        generate(engine, args.scenario, count=args.bodies, seed=args.seed)
+    else:
+        engine = SimulationEngine(scenario=args.scenario)
+    if args.resume:
+        restore_checkpoint(args.resume, engine)
+    engine.force_backend = args.backend
+    engine.theta = args.theta
+    engine.fmm_order = args.fmm_order
+    engine.workers = args.workers
+    engine.set_integrator(args.integrator)
+    engine.block_timesteps = args.block_timesteps
+    engine.record_trails = False
+    # every recorded frame holds the same bodies, a merger part way through would change their number
+    recording = bool(args.record_every or args.trajectory)
+    engine.collisions = not args.no_collisions and not recording
+    if recording and not args.no_collisions:
+        print("Collisions are off while frames are recorded")
+    if args.diagnostics:
+        engine.diagnostics = Diagnostics(args.diagnostics_every)
+        engine.diagnostics.open_stream(args.diagnostics)
+        engine.diagnostics.sample(engine)  # the reference energy before the first step
+
+    start = time.perf_counter()
+    trajectory = TrajectoryWriter(args.trajectory, engine) if args.trajectory else None
+    try:
+        times, positions, velocities = run(engine, args.steps, args.dt, args.record_every,
+                                           trajectory, args.checkpoint, args.checkpoint_every)
+    finally:
+        engine.close()
+        if engine.diagnostics is not None:
+            engine.diagnostics.close()
+        if trajectory is not None:
+            trajectory.close()
+    elapsed = time.perf_counter() - start
+
+    if args.output.endswith(".csv"):
+        write_csv(args.output, engine)
+    else:
+        write_npz(args.output, engine, times, positions, velocities)
+    print("Simulated", args.steps, "steps of", len(engine.bodies), "bodies in", round(elapsed, 3), "s",
+          "(" + str(int(args.steps / elapsed)) + " steps/s)" if elapsed > 0 else "")
+    if engine.diagnostics is not None and engine.diagnostics.latest() is not None:
+        print("Relative energy drift:", engine.diagnostics.latest()["energy_drift"])
+
+
+if __name__ == "__main__":
+    main()
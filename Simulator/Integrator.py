@@ -0,0 +1,99 @@
+"""
+Time integrators for the state arrays
+
+Every integrator advances pos and vel in place by one time step, using acceleration_function(pos)
+to evaluate the accelerations at a set of positions. force_key stands for whatever else the forces
+depend on, e.g. backend and softening, so integrators that keep accelerations know when to drop them.
+"""
+
+import numpy as np
+
+
+class Integrator:
+    name = "integrator"
+    # how much larger steps than semi-implicit Euler the scheme keeps stable at a similar energy error
+    max_speed_factor = 1
+
+    def step(self, pos, vel, time_step, acceleration_function, force_key=None):
+        raise NotImplementedError
+
+    def reset(self):
+        pass
+
+
+class SemiImplicitEuler(Integrator):
+    name = "euler"
+
+    def step(self, pos, vel, time_step, acceleration_function, force_key=None):
+        vel += acceleration_function(pos) * time_step
+        pos += vel * time_step
+
+
+class Leapfrog(Integrator):
+    # kick-drift-kick leapfrog, equivalent to velocity Verlet
+    name = "leapfrog"
+    max_speed_factor = 10
+
+    def __init__(self):
+        # the closing kick's acceleration is the next opening kick's, as long as nothing moved or changed in between
+        self.cached_pos = None
+        self.cached_acceleration = None
+        self.force_key = None
+
+    def step(self, pos, vel, time_step, acceleration_function, force_key=None):
+        if (self.cached_pos is not None and force_key == self.force_key and self.cached_pos.shape == pos.shape
+                and np.array_equal(self.cached_pos, pos)):
+            acceleration = self.cached_acceleration
+        else:
+            acceleration = acceleration_function(pos)
+        vel += acceleration * (time_step / 2)
+        pos += vel * time_step
+        acceleration = acceleration_function(pos)
+        vel += acceleration * (time_step / 2)
+        self.cached_pos = pos.copy()
+        self.cached_acceleration = acceleration
+        self.force_key = force_key
+
+    def reset(self):
+        self.cached_pos = None
+        self.cached_acceleration = None
+        self.force_key = None
+
+
+class Yoshida4(Integrator):
+    # fourth order symplectic integrator, three leapfrog steps with Yoshida's weights
+    name = "yoshida4"
+    max_speed_factor = 100
+
+    W1 = 1 / (2 - 2 ** (1 / 3))
+    W0 = -2 ** (1 / 3) * W1
+    DRIFTS = (W1 / 2, (W0 + W1) / 2, (W0 + W1) / 2, W1 / 2)
+    KICKS = (W1, W0, W1)
+
+    def step(self, pos, vel, time_step, acceleration_function, force_key=None):
+        for i, kick in enumerate(self.KICKS):
+            pos += vel * (self.DRIFTS[i] * time_step)
+            vel += acceleration_function(pos) * (kick * time_step)
+        pos += vel * (self.DRIFTS[3] * time_step)
+
+
+class RK4(Integrator):
+    # classic fourth order Runge-Kutta, accurate but not symplectic
+    name = "rk4"
+    max_speed_factor = 100
+
+    def step(self, pos, vel, time_step, acceleration_function, force_key=None):
+        half = time_step / 2
+        k1_pos = vel.copy()
+        k1_vel = acceleration_function(pos)
+        k2_pos = vel + k1_vel * half
+        k2_vel = acceleration_function(pos + k1_pos * half)
+        k3_pos = vel + k2_vel * half
+        k3_vel = acceleration_function(pos + k2_pos * half)
+        k4_pos = vel + k3_vel * time_step
+        k4_vel = acceleration_function(pos + k3_pos * time_step)
+        pos += (k1_pos + 2 * k2_pos + 2 * k3_pos + k4_pos) * (time_step / 6)
+        vel += (k1_vel + 2 * k2_vel + 2 * k3_vel + k4_vel) * (time_step / 6)
+
+
+INTEGRATORS = {integrator.name: integrator for integrator in (SemiImplicitEuler, Leapfrog, Yoshida4, RK4)}
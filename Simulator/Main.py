@@ -1,67 +1,123 @@
 """
 Main
 
-TODO:
-    - implement adding celestial bodies live
+Bodies are added live from the new body panel and removed by right clicking them.
 """
 
+import logging
+import os
+
 import pygame as p
 from win32api import GetSystemMetrics
 from Vector import Vector2
 from SimulationEngine import SimulationEngine
+from Scheduler import FixedTimestepScheduler
+from Diagnostics import Diagnostics
+from Profiler import FrameProfiler
 from Display import Display, FORM, BUTTON
+from Snapshot import save_checkpoint, restore_checkpoint
+from Recording import Recorder
 
 # GLOBALS
 SCREENSIZE = 1
 WIDTH = int(GetSystemMetrics(0) * SCREENSIZE)
 HEIGHT = int(GetSystemMetrics(1) * SCREENSIZE)
 FPS = 30
+CHECKPOINT_FILE = "checkpoint.nbs"
+PHYSICS_HZ = 1000
+TRAIL_LENGTH = 100
+TRAIL_DECIMATION = PHYSICS_HZ // FPS  # physics steps per trail point, about one per drawn frame
+DIAGNOSTICS_INTERVAL = 500  # physics steps between energy and momentum samples
+PROFILE_FILE = "profile.json"
+LOG_LEVEL = logging.WARNING  # F2 switches between this and DEBUG
+DIRTY_RECTS = True  # only push the changed parts of the screen
+IDLE_FPS = 5  # loop rate while paused without input, nothing is drawn then
+RIGHT_MOUSE_BUTTON = 3  # removes the body under the mouse
+SEED = None  # seed for every random choice, None picks one (it is logged)
+RECORD_FILE = None  # e.g. "session.jsonl", records the session for Headless.py --replay
 
 
 def main():
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     p.display.set_caption("N-Body Simulator")
     screen.fill(p.Color("black"))
     clock = p.time.Clock()
-    Simulation_Engine = SimulationEngine()
-    display = Display(WIDTH, HEIGHT)
+    Simulation_Engine = SimulationEngine(seed=SEED)
+    logging.info("Random seed %s", Simulation_Engine.seed)
+    Simulation_Engine.scheduler = FixedTimestepScheduler(PHYSICS_HZ)
+    Simulation_Engine.trails.configure(TRAIL_LENGTH, TRAIL_DECIMATION)
+    Simulation_Engine.diagnostics = Diagnostics(DIAGNOSTICS_INTERVAL)
+    if RECORD_FILE:
+        Simulation_Engine.recorder = Recorder(RECORD_FILE, Simulation_Engine)
+    display = Display(WIDTH, HEIGHT, Simulation_Engine.seed)
     display.create_ui_objects(Simulation_Engine)
+    display.dirty_rendering = DIRTY_RECTS
+    profiler = FrameProfiler()
+    display.profiler = profiler
     # test(display)
     running = True
     while running:
-        for e in p.event.get():
-            if e.type == p.QUIT:
-                running = False
-            elif e.type == p.KEYDOWN:
-                if e.key == p.K_ESCAPE:
+        had_input = False
+        with profiler.phase("events"):
+            for e in p.event.get():
+                had_input = True
+                if e.type == p.QUIT:
                     running = False
-                ResolveKeyDown(e, display, Simulation_Engine)
-
-            elif e.type == p.KEYUP:
-                ResolveKeyUpAxis(e.key, display)
-
-            elif e.type == p.MOUSEWHEEL:
-                # print(e.y)
-                display.zoom(e.y)
-
-            elif e.type == p.MOUSEBUTTONDOWN:
-                done = Resolve_UI_Click(e, display)
-                if not done:
-                    display.mouse_down = True
-                    display.last_mouse_pos = p.mouse.get_pos()
-
-            elif e.type == p.MOUSEBUTTONUP:
-                display.mouse_down = False
-                display.camera_movement = Vector2.zero()
-
-        p.display.flip()
-        screen.fill(p.Color("black"))
-        delta_time = clock.tick(FPS)
-        Simulation_Engine.Update(delta_time, display)
-        display.update_paths(Simulation_Engine)
-        display.camera_drag(p.mouse.get_pos())
-        display.draw_simulation(screen, Simulation_Engine)
+                elif e.type == p.KEYDOWN:
+                    if e.key == p.K_ESCAPE:
+                        running = False
+                    ResolveKeyDown(e, display, Simulation_Engine, profiler)
+
+                elif e.type == p.KEYUP:
+                    ResolveKeyUpAxis(e.key, display)
+
+                elif e.type == p.MOUSEWHEEL:
+                    # print(e.y)
+                    display.zoom(e.y)
+
+                elif e.type == p.MOUSEBUTTONDOWN and e.button == RIGHT_MOUSE_BUTTON:
+                    body = display.body_at(Simulation_Engine, e.pos)
+                    if body is not None:
+                        logging.info("Removing body %s", body.name)
+                        Simulation_Engine.delete_body(body)
+
+                elif e.type == p.MOUSEBUTTONDOWN:
+                    done = Resolve_UI_Click(e, display)
+                    if not done:
+                        display.mouse_down = True
+                        display.last_mouse_pos = p.mouse.get_pos()
+
+                elif e.type == p.MOUSEBUTTONUP:
+                    display.mouse_down = False
+                    display.camera_movement = Vector2.zero()
+
+        if display.is_idle(Simulation_Engine, had_input):
+            # paused and nothing happening, don't redraw the same frame
+            clock.tick(IDLE_FPS)
+            profiler.skip_frame()
+            continue
+        with profiler.phase("wait"):
+            # time left over in the frame, spent sleeping to hold the FPS
+            delta_time = clock.tick(FPS)
+        with profiler.phase("update"):
+            Simulation_Engine.Update(delta_time, display)
+        with profiler.phase("paths"):
+            display.update_paths(Simulation_Engine)
+        with profiler.phase("camera"):
+            display.camera_drag(p.mouse.get_pos())
+        with profiler.phase("draw"):
+            # no fill needed, draw_simulation starts by drawing the whole background
+            display.draw_simulation(screen, Simulation_Engine)
+        with profiler.phase("present"):
+            display.present()
+        profiler.end_frame()
+
+    display.close()
+    if Simulation_Engine.recorder is not None:
+        Simulation_Engine.recorder.close()
+    Simulation_Engine.close()
 
 
 def Resolve_UI_Click(e, display):
@@ -77,7 +133,7 @@ def Resolve_UI_Click(e, display):
     return False
 
 
-def ResolveKeyDown(event, display, engine):
+def ResolveKeyDown(event, display, engine, profiler):
     for ui in display.ui_objects:
         if ui.type == FORM:
             done = ui.handle_event(event)
@@ -100,12 +156,33 @@ def ResolveKeyDown(event, display, engine):
     elif key == p.K_x:
         engine.change_sim_speed(10)
 
+    if key == p.K_i:
+        engine.next_integrator()
+    elif key == p.K_b:
+        engine.toggle_block_timesteps()
+
     if key == p.K_c:
         display.show_paths = not display.show_paths
 
     if key == p.K_SPACE:
         engine.toggle_pause()
 
+    if key == p.K_F2:
+        root = logging.getLogger()
+        root.setLevel(logging.DEBUG if root.level != logging.DEBUG else LOG_LEVEL)
+    elif key == p.K_F3:
+        profiler.show = not profiler.show
+    elif key == p.K_F4:
+        profiler.dump(PROFILE_FILE)
+        logging.info("Wrote the frame profile to %s", PROFILE_FILE)
+
+    if key == p.K_F5:
+        save_checkpoint(CHECKPOINT_FILE, engine)
+    elif key == p.K_F9 and os.path.exists(CHECKPOINT_FILE):
+        restore_checkpoint(CHECKPOINT_FILE, engine)
+        if engine.recorder is not None:
+            engine.recorder.restored(engine)
+
 
 def ResolveKeyUpAxis(key, display):
     if key == p.K_LEFT or key == p.K_a or key == p.K_RIGHT or key == p.K_d:
@@ -116,8 +193,8 @@ def ResolveKeyUpAxis(key, display):
 
 def test(display):
     screen_pos = display.world_coordinate_to_screen_pixel(Vector2(2, 2))
-    print("Screen pos of world coordinate (2, 2) is: " + str(screen_pos))
-    print("World pos of screen coordinate " + str(screen_pos) + " is: " + str(display.screen_pixel_to_world_coordinate(screen_pos)))
+    logging.info("Screen pos of world coordinate (2, 2) is: %s", screen_pos)
+    logging.info("World pos of screen coordinate %s is: %s", screen_pos, display.screen_pixel_to_world_coordinate(screen_pos))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+"""
+Multi-core direct force evaluation
+
+Positions and masses are copied into shared memory once per evaluation; a process pool then
+computes the accelerations of chunks of target bodies in parallel and writes them straight into a
+shared output buffer, so no arrays are pickled between the processes.
+
+Running this module benchmarks the scaling with the number of workers:
+
+    python ParallelForces.py --bodies 20000
+"""
+
+import argparse
+import atexit
+import os
+import time
+import weakref
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+from Gravity import direct_accelerations
+
+# arrays attached to the shared memory inside each worker process
+_worker_memory = None
+_worker_arrays = None
+
+# evaluators still alive in the main process, closed at exit; dropped ones don't keep their pool alive
+_evaluators = weakref.WeakSet()
+
+
+@atexit.register
+def _close_all():
+    for evaluator in list(_evaluators):
+        evaluator.close()
+
+
+def _attach(name, capacity):
+    global _worker_memory, _worker_arrays
+    _worker_memory = shared_memory.SharedMemory(name=name)
+    _worker_arrays = _layout(_worker_memory.buf, capacity)
+
+
+def _layout(buffer, capacity):
+    # pos, mass, target indices and output acceleration, back to back in one buffer
+    pos = np.ndarray((capacity, 2), dtype=np.float64, buffer=buffer)
+    mass = np.ndarray(capacity, dtype=np.float64, buffer=buffer, offset=pos.nbytes)
+    targets = np.ndarray(capacity, dtype=np.int64, buffer=buffer, offset=pos.nbytes + mass.nbytes)
+    out = np.ndarray((capacity, 2), dtype=np.float64, buffer=buffer, offset=pos.nbytes + mass.nbytes + targets.nbytes)
+    return pos, mass, targets, out
+
+
+def _buffer_size(capacity):
+    return capacity * (2 * 8 + 8 + 8 + 2 * 8)
+
+
+def _work(task):
+    n, start, end, big_g, softening = task
+    pos, mass, targets, out = _worker_arrays
+    out[start:end] = direct_accelerations(pos[:n], mass[:n], big_g, targets[start:end], softening)
+
+
+class ParallelForceEvaluator:
+    def __init__(self, workers=None, min_bodies=512):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_bodies = min_bodies  # below this the pool overhead isn't worth it
+        self.chunks_per_worker = 4  # more chunks than workers evens out the load
+        self.capacity = 0
+        self.memory = None
+        self.arrays = None
+        self.pool = None
+        _evaluators.add(self)
+
+    def _ensure_capacity(self, n):
+        if n <= self.capacity and self.pool is not None:
+            return
+        self.close()
+        capacity = max(1024, 1 << (n - 1).bit_length())
+        self.memory = shared_memory.SharedMemory(create=True, size=_buffer_size(capacity))
+        self.arrays = _layout(self.memory.buf, capacity)
+        self.capacity = capacity
+        self.pool = Pool(self.workers, initializer=_attach, initargs=(self.memory.name, capacity))
+
+    def accelerations(self, pos, mass, big_g, targets=None, softening=0.0):
+        n = len(pos)
+        target_count = n if targets is None else len(targets)
+        if n < self.min_bodies or self.workers <= 1:
+            return direct_accelerations(pos, mass, big_g, targets, softening)
+
+        self._ensure_capacity(n)
+        shared_pos, shared_mass, shared_targets, out = self.arrays
+        shared_pos[:n] = pos
+        shared_mass[:n] = mass
+        shared_targets[:target_count] = np.arange(n) if targets is None else targets
+
+        chunk = max(1, -(-target_count // (self.workers * self.chunks_per_worker)))
+        tasks = [(n, start, min(start + chunk, target_count), big_g, softening)
+                 for start in range(0, target_count, chunk)]
+        self.pool.map(_work, tasks)
+        return out[:target_count].copy()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.memory is not None:
+            self.arrays = None
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+        self.capacity = 0
+
+    def __del__(self):
+        self.close()
+
+
+def benchmark(bodies, worker_counts, repeats=3):
+    # seconds per full acceleration pass for each worker count
+    rng = np.random.default_rng(0)
+    pos = rng.normal(size=(bodies, 2)) * 1e5
+    mass = rng.uniform(1, 10, bodies)
+    results = {}
+    for workers in worker_counts:
+        evaluator = ParallelForceEvaluator(workers, min_bodies=0)
+        evaluator.accelerations(pos, mass, 1.0)  # start the pool outside the timing
+        start = time.perf_counter()
+        for _ in range(repeats):
+            evaluator.accelerations(pos, mass, 1.0)
+        results[workers] = (time.perf_counter() - start) / repeats
+        evaluator.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parallel force evaluation scaling")
+    parser.add_argument("--bodies", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    counts = []
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        counts.append(workers)
+        workers *= 2
+    timings = benchmark(args.bodies, counts, args.repeats)
+    print("workers  seconds  speedup")
+    for workers, seconds in timings.items():
+        print(f"{workers:7d}  {seconds:7.3f}  {timings[1] / seconds:7.2f}")
@@ -1,99 +1,425 @@
+"""
+Orbit prediction
+
+CelestialPath integrates a copy of the bodies ahead of the engine and keeps the predicted positions
+in a ring buffer: as the engine catches up, the steps it has simulated are overwritten with new
+ones at the far end, so the horizon stays the same length without copying. AsyncCelestialPath runs
+it in a worker process, which keeps the prediction off the frame loop's GIL. The ring buffers live
+in shared memory, two of them so a rebuild never writes into the prediction being drawn.
+"""
+
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from BarnesHut import barnes_hut_accelerations
+from FastMultipole import fmm_accelerations
+from Gravity import direct_accelerations
 from Vector import Vector2
-from CelestialBody import VirtualBody, CelestialBody
-from SimulationEngine import SimulationEngine
+from CelestialBody import CelestialBody
+from SimulationEngine import SimulationEngine, BARNES_HUT, FMM
 from Universe import Universe
-import pygame as p
+
+log = logging.getLogger(__name__)
+
+# predicted positions a prediction may hold (steps times bodies), 32 MB; the horizon of big systems is cut short
+MAX_PREDICTION_POINTS = 2000000
+WORKER_NICENESS = 19  # added to the prediction worker's niceness, it only gets the CPU time the frame loop leaves over
 
 
 class Path:
-    def __init__(self):
-        self.points: list[Vector2] = []
+    def __init__(self, array=None):
+        self.array = array  # (steps, 2) array of predicted world positions
+        self._points = None
         self.color = None
 
+    @property
+    def points(self) -> list[Vector2]:
+        if self._points is None:
+            self._points = [] if self.array is None else [Vector2(x, y) for x, y in self.array.tolist()]
+        return self._points
+
+
+class PredictionRequest:
+    # a copy of everything a prediction needs from the engine, safe to hand to another thread
+    def __init__(self, engine: SimulationEngine, preview, key, generation=0, accelerations=None):
+        self.key = key
+        self.generation = generation
+        self.sim_time = engine.sim_time
+        self.pos = engine.state.pos.copy()
+        self.vel = engine.state.vel.copy()
+        self.masses = engine.state.mass.copy()
+        self.colors = engine.bodies.colors()
+        self.integrator_type = type(engine.integrator)
+        # without an explicit function forces are computed from these settings, never through the engine
+        self.accelerations = accelerations
+        self.force_backend = engine.force_backend
+        self.theta = engine.theta
+        self.fmm_order = engine.fmm_order
+        self.softening = engine.softening
+
+        # add the in progress new celestial body
+        if preview is not None:
+            real_version_of_in_progress_body = CelestialBody(preview.pos, preview.radius, preview.gravity, 1,
+                                                             preview.initial_velocity, preview.name,
+                                                             "white")
+            self.pos = np.vstack((self.pos, [real_version_of_in_progress_body.pos.tuple()]))
+            self.vel = np.vstack((self.vel, [real_version_of_in_progress_body.velocity.tuple()]))
+            self.masses = np.append(self.masses, real_version_of_in_progress_body.mass)
+            self.colors.append(real_version_of_in_progress_body.color)
+
+    def acceleration_function(self):
+        if self.accelerations is not None:
+            return lambda positions: self.accelerations(positions, self.masses)
+        if self.force_backend == BARNES_HUT:
+            return lambda positions: barnes_hut_accelerations(positions, self.masses, Universe.Big_G, self.theta,
+                                                              softening=self.softening)
+        if self.force_backend == FMM:
+            return lambda positions: fmm_accelerations(positions, self.masses, Universe.Big_G, self.fmm_order,
+                                                       softening=self.softening)
+        # the parallel backend's worker pool belongs to the engine, predictions use the direct sum
+        return lambda positions: direct_accelerations(positions, self.masses, Universe.Big_G, softening=self.softening)
+
+
+class Prediction:
+    # a finished or partial prediction of length steps, step k of it is time_step * (k + 1) after start_time
+    # and at trajectory[(head + k) % len(trajectory)]
+    def __init__(self, generation, key, start_time, time_step, trajectory, head, length, colors, written=None,
+                 writes=None):
+        self.generation = generation
+        self.key = key
+        self.start_time = start_time
+        self.time_step = time_step
+        self.trajectory = trajectory
+        self.head = head
+        self.length = length
+        self.colors = colors
+        # shared trajectories: counter of the rebuilds into their buffer, and its value when this was published
+        self.written = written
+        self.writes = writes
+
+    def get_paths(self, engine: SimulationEngine, max_points=None):
+        # the part of the prediction still ahead of the engine, thinned out to about max_points per path;
+        # None if a newer prediction has been written over it in the meantime
+        if self.key[0] != engine.bodies_version:
+            return []
+        size = len(self.trajectory)
+        offset = max(0, int((engine.sim_time - self.start_time) / self.time_step))
+        stride = 1
+        if max_points is not None and size > max_points:
+            # from the full size, so a partial prediction is thinned out the same way as it grows
+            stride = -(-size // max_points)
+            # sample the same steps every frame so the drawn paths don't flicker
+            offset = -(-offset // stride) * stride
+        # a copy, the ring buffer keeps moving on
+        trajectory = self.trajectory[(self.head + np.arange(offset, self.length, stride)) % size]
+        if self.written is not None and self.written[0] != self.writes:
+            return None
+
+        # world positions, any change of reference frame is up to whoever draws them
+        paths: list[Path] = []
+        for i, color in enumerate(self.colors):
+            path = Path(trajectory[:, i])
+            path.color = color
+            paths.append(path)
+        return paths
+
 
 class CelestialPath:
-    def __init__(self):
-        self.virtual_bodies: list[VirtualBody] = []
-        self.reference_index = 0
-        self.central_body = None
-        self.reference_initial_position = Vector2.zero()
+    def __init__(self, max_points=MAX_PREDICTION_POINTS, buffers=None):
         self.num_steps = 1000
         self.time_step = 0.01
+        self.max_points = max_points  # bodies times steps, fewer steps are predicted for big systems
+        self.publish_every = None  # steps between the partial predictions a rebuild hands out, None for none
 
-    def get_paths(self, engine: SimulationEngine, get_relative, newBody):
-        if engine.central_body:
-            self.central_body = engine.central_body
-        # print("Central body:", str(self.central_body))
-        paths: list[Path] = []
-        self.virtual_bodies = []
-        # initialize virtual bodies (don't move actual bodies)
-        for body in engine.bodies:
-            new_virtual = VirtualBody(body)
-            self.virtual_bodies.append(new_virtual)
-            newPath = Path()
-            newPath.color = body.color
-            paths.append(newPath)
-
-            if body == self.central_body and get_relative:
-                # print("Reference body found!")
-                self.reference_index = engine.bodies.index(body)
-                self.reference_initial_position = body.pos
-        # add the in progress new celestial body
-        if engine.new_celestial_body is not None and newBody:
-            print("Getting in progress body path")
-            real_version_of_in_progress_body = CelestialBody(engine.new_celestial_body.pos,
-                                                             engine.new_celestial_body.radius,
-                                                             engine.new_celestial_body.gravity,
-                                                             engine.new_celestial_body.initial_velocity,
-                                                             engine.new_celestial_body.name,
-                                                             p.Color("white"))
-            new_virtual = VirtualBody(real_version_of_in_progress_body)
-            self.virtual_bodies.append(new_virtual)
-            newPath = Path()
-            newPath.color = real_version_of_in_progress_body.color
-            paths.append(newPath)
-
-        # simulate
-        for step in range(self.num_steps):
-            reference_body_pos = self.virtual_bodies[self.reference_index].position if get_relative else Vector2.zero()
-            # update velocities
-            for i in range(len(self.virtual_bodies)):
-                self.virtual_bodies[i].velocity += self.calculate_acceleration(i, self.virtual_bodies) * self.time_step
-
-            # update positions
-            for i in range(len(self.virtual_bodies)):
-                # TODO: remove this quickfix of nonetype errors
-                try:
-                    newPos = self.virtual_bodies[i].position + self.virtual_bodies[i].velocity * self.time_step
-                except TypeError:
-                    print("wierd nonetype error on path generation occured")
-                    newPos = self.virtual_bodies[i].position
-                self.virtual_bodies[i].position = newPos
-                if get_relative:
-                    reference_offset = reference_body_pos - self.reference_initial_position
-                    newPos -= reference_offset
-
-                if get_relative and i == self.reference_index:
-                    newPos = self.reference_initial_position
-
-                try:
-                    paths[i].points.append(newPos)
-                except IndexError:
-                    print("Error, index", i, "out of range!")
+        # prediction cache
+        self.trajectory = None  # (steps, bodies, 2) ring buffer of predicted positions
+        self.head = 0  # row of the first cached step
+        self.length = 0  # steps predicted so far, less than the rows while rebuilding
+        self.buffers = buffers  # memory to lay the ring buffer out in, used in turn on every rebuild; None allocates
+        self.buffer = 0
+        self.tail_pos = None  # state after the last predicted step
+        self.tail_vel = None
+        self.masses = None
+        self.integrator = None  # own instance of the engine's integrator type
+        self.accelerations = None
+        self.colors = []
+        self.cache_key = None
+        self.cache_time = 0.0  # engine sim_time the first cached step follows
+        self.steps_since_rebuild = 0
 
-        return paths
+    def get_paths(self, engine: SimulationEngine, newBody, max_points=None):
+        preview = self.get_preview(engine, newBody)
+        request = PredictionRequest(engine, preview, self.get_cache_key(engine, preview),
+                                    accelerations=engine.accelerations)
+        return self.update(request).get_paths(engine, max_points)
+
+    @staticmethod
+    def get_preview(engine, newBody):
+        return engine.new_celestial_body if engine.new_celestial_body is not None and newBody else None
 
     @staticmethod
-    def calculate_acceleration(i, virtual_bodies):
-        acceleration = Vector2.zero()
-        for j in range(len(virtual_bodies)):
-            if i == j:
-                continue
-            force_dir = (virtual_bodies[j].position - virtual_bodies[i].position).normalize()
-            distance = (virtual_bodies[j].position - virtual_bodies[i].position).magnitude()
-            if distance == 0:
-                acceleration = Vector2.zero()
-            else:
-                acceleration += force_dir * Universe.Big_G * virtual_bodies[j].mass / distance
-
-        return acceleration
+    def get_cache_key(engine, preview):
+        # the cached prediction is thrown away whenever one of these changes
+        preview_key = None
+        if preview is not None:
+            preview_key = (preview.pos.tuple(), preview.initial_velocity.tuple(), preview.radius, preview.gravity)
+        return engine.bodies_version, engine.simulation_speed, engine.force_backend, engine.integrator.name, preview_key
+
+    def update(self, request: PredictionRequest, cancelled=None, published=None):
+        # brings the cache up to the request's time, returns the Prediction or None when cancelled;
+        # published(prediction) is handed the partial predictions of a rebuild, every publish_every steps
+        if request.key != self.cache_key or self.trajectory is None or not self.advance(request, cancelled):
+            if not self.rebuild(request, cancelled, published):
+                self.cache_key = None
+                return None
+            self.cache_key = request.key
+        return self.prediction(request)
+
+    def prediction(self, request: PredictionRequest):
+        return Prediction(request.generation, request.key, self.cache_time, self.time_step, self.trajectory,
+                          self.head, self.length, self.colors, *self.buffer_writes())
+
+    def rebuild(self, request: PredictionRequest, cancelled=None, published=None):
+        self.tail_pos = request.pos.copy()
+        self.tail_vel = request.vel.copy()
+        self.masses = request.masses
+        self.colors = request.colors
+        self.integrator = request.integrator_type()
+        self.accelerations = request.acceleration_function()
+        bodies = len(self.tail_pos)
+        self.trajectory = self.allocate(max(1, min(self.num_steps, self.max_points // max(1, bodies))), bodies)
+        self.head = 0
+        self.cache_time = request.sim_time
+        self.steps_since_rebuild = 0
+        self.length = 0
+        steps = len(self.trajectory)
+        while self.length < steps:
+            chunk = min(self.publish_every or steps, steps - self.length)
+            if not self.simulate(self.length, chunk, cancelled):
+                self.trajectory = None
+                return False
+            self.length += chunk
+            if published is not None and self.length < steps:
+                published(self.prediction(request))
+        return True
+
+    def allocate(self, steps, bodies):
+        if self.buffers is None:
+            if self.trajectory is not None and self.trajectory.shape == (steps, bodies, 2):
+                return self.trajectory
+            return np.empty((steps, bodies, 2))
+        # the other buffer, the one last published may still be read; its rebuild counter goes up first
+        self.buffer = (self.buffer + 1) % len(self.buffers)
+        self.buffer_writes()[0][0] += 1
+        return np.ndarray((steps, bodies, 2), dtype=np.float64, buffer=self.buffers[self.buffer], offset=8)
+
+    def buffer_writes(self):
+        # (counter of the rebuilds into the current buffer, its value), (None, None) without shared buffers
+        if self.buffers is None:
+            return None, None
+        written = np.ndarray(1, dtype=np.int64, buffer=self.buffers[self.buffer])
+        return written, int(written[0])
+
+    def advance(self, request: PredictionRequest, cancelled=None):
+        # overwrite the steps the engine has already simulated with as many new ones at the end,
+        # returns False when the cache can't be reused
+        consumed = int((request.sim_time - self.cache_time) / self.time_step)
+        if consumed < 0:
+            return False
+        if consumed == 0:
+            return True
+        steps = len(self.trajectory)
+        self.steps_since_rebuild += consumed
+        if self.steps_since_rebuild >= steps:
+            # the whole horizon has been replaced, start over from the real state so errors don't pile up
+            return False
+        if not self.simulate(self.head, consumed, cancelled):
+            return False
+        self.head = (self.head + consumed) % steps
+        self.cache_time += consumed * self.time_step
+        return True
+
+    def simulate(self, start, steps, cancelled=None, check_every=256):
+        # continues from the tail into the ring buffer rows from start on, False when cancelled part way
+        pos = self.tail_pos
+        vel = self.tail_vel
+        size = len(self.trajectory)
+        for step in range(steps):
+            if cancelled is not None and step % check_every == 0 and cancelled():
+                return False
+            self.integrator.step(pos, vel, self.time_step, self.accelerations)
+            self.trajectory[(start + step) % size] = pos
+        return True
+
+
+def _shared_buffer_size(max_points):
+    # rebuild counter, then the trajectory
+    return 8 + 16 * max_points
+
+
+def _predict(requests, results, memory_names, num_steps, time_step, max_points):
+    # worker process: handles the newest request, a request for different bodies or settings cancels the one in progress
+    if hasattr(os, "nice"):
+        # on a busy machine the frame loop comes first, a prediction can arrive a little later
+        os.nice(WORKER_NICENESS)
+    memories = [shared_memory.SharedMemory(name=name) for name in memory_names]
+    predictor = CelestialPath(max_points, [memory.buf for memory in memories])
+    predictor.num_steps = num_steps
+    predictor.time_step = time_step
+    # partial predictions keep the paths on screen while a long horizon is rebuilt
+    predictor.publish_every = max(1, num_steps // 50)
+    newest = [None]
+
+    def shared(prediction):
+        # what the main process needs to find a prediction in the shared buffers
+        return (prediction.key, prediction.start_time, prediction.head, prediction.length, prediction.trajectory.shape,
+                predictor.buffer, prediction.writes)
+
+    def receive(block):
+        # False once the worker has to stop
+        while True:
+            try:
+                request = requests.get(block=block)
+            except queue.Empty:
+                return True
+            if request is None:
+                return False
+            newest[0] = request
+            block = False
+
+    while receive(newest[0] is None):
+        request, newest[0] = newest[0], None
+        stopped = [False]
+
+        def cancelled():
+            stopped[0] = stopped[0] or not receive(False)
+            return stopped[0] or (newest[0] is not None and newest[0].key != request.key)
+
+        def published(prediction):
+            results.put((request.generation, shared(prediction), False))
+
+        result = None
+        try:
+            prediction = predictor.update(request, cancelled, published)
+            if prediction is not None:
+                result = shared(prediction)
+        except Exception:
+            log.exception("Orbit prediction failed")
+            predictor.cache_key = None
+        results.put((request.generation, result, True))
+        if stopped[0]:
+            break
+
+    predictor.trajectory = None
+    predictor.buffers = None
+    for memory in memories:
+        memory.close()
+
+
+class AsyncCelestialPath:
+    # CelestialPath in a worker process: get_paths only hands over a snapshot and draws the newest finished prediction
+
+    def __init__(self, num_steps=1000, time_step=0.01, max_points=MAX_PREDICTION_POINTS):
+        self.num_steps = num_steps
+        self.time_step = time_step
+        # steps the engine may get ahead of the newest prediction before it is extended, drawing just skips them
+        self.refresh_steps = max(1, num_steps // 50)
+        self.generation = 0
+        self.done = 0  # generation of the last request the worker finished
+        self.submitted = None  # (key, sim_time) of the last request sent
+        self.colors = {}  # colors of the requests in flight, by generation
+        self.result: Prediction = None
+        self.last_paths = []
+        self.memories = [shared_memory.SharedMemory(create=True, size=_shared_buffer_size(max_points))
+                         for _ in range(2)]
+        for memory in self.memories:
+            memory.buf[:8] = bytes(8)
+        self.requests = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_predict, daemon=True,
+                                               args=(self.requests, self.results, [memory.name for memory in self.memories],
+                                                     num_steps, time_step, max_points))
+        self.process.start()
+        self.closed = False
+        atexit.register(self.close)
+
+    def get_paths(self, engine: SimulationEngine, newBody, max_points=None):
+        preview = CelestialPath.get_preview(engine, newBody)
+        self.poll()
+        self.submit(engine, preview)
+        if self.result is not None:
+            paths = self.result.get_paths(engine, max_points)
+            # overwritten while it was read, the worker has already published a newer one
+            if paths is not None:
+                self.last_paths = paths
+        return self.last_paths
+
+    def submit(self, engine, preview):
+        key = CelestialPath.get_cache_key(engine, preview)
+        if self.submitted is not None and self.submitted[0] == key and \
+                0 <= engine.sim_time - self.submitted[1] < self.refresh_steps * self.time_step:
+            # the prediction on its way still covers this
+            return
+        self.generation += 1
+        request = PredictionRequest(engine, preview, key, self.generation)
+        # the colors are only needed to draw the result, not in the worker
+        self.colors[self.generation] = request.colors
+        request.colors = None
+        self.submitted = key, engine.sim_time
+        self.requests.put(request)
+
+    def poll(self, timeout=0.0):
+        # takes in the predictions the worker has finished or published part of, waiting up to timeout for the first one
+        while True:
+            try:
+                generation, result, finished = self.results.get(timeout=timeout) if timeout else self.results.get_nowait()
+            except queue.Empty:
+                return
+            timeout = 0.0
+            if finished:
+                self.done = generation
+            colors = self.colors.get(generation)
+            for old in [old for old in self.colors if old < generation]:
+                del self.colors[old]
+            if result is not None and colors is not None:
+                key, start_time, head, length, shape, buffer, writes = result
+                memory = self.memories[buffer]
+                trajectory = np.ndarray(shape, dtype=np.float64, buffer=memory.buf, offset=8)
+                written = np.ndarray(1, dtype=np.int64, buffer=memory.buf)
+                self.result = Prediction(generation, key, start_time, self.time_step, trajectory, head, length, colors,
+                                         written, writes)
+
+    def wait(self, timeout=None):
+        # blocks until the worker has handled every submitted request, False on timeout
+        while self.done != self.generation:
+            if not self.process.is_alive():
+                return False
+            result = self.result
+            before = self.done
+            self.poll(timeout if timeout is not None else 1.0)
+            if timeout is not None and self.done == before and self.result is result:
+                return False
+        return True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.requests.put(None)
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.result = None
+        self.last_paths = []
+        for memory in self.memories:
+            memory.close()
+            memory.unlink()
+        self.requests.close()
+        self.results.close()
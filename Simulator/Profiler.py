@@ -0,0 +1,79 @@
+"""
+Contains class FrameProfiler, timing of the phases of every frame
+
+Each phase of the main loop runs inside profiler.phase(name); the last window frames of every
+phase are kept for rolling averages and percentiles, shown in the overlay and written by dump.
+"""
+
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+FRAME = "frame"  # the whole frame, from one end_frame to the next
+
+
+class FrameProfiler:
+    def __init__(self, window=120):
+        self.window = window  # frames kept per phase
+        self.enabled = True
+        self.show = False  # draw the overlay
+        self.times = {}  # phase name -> deque of milliseconds, in the order the phases first ran
+        self.frames = 0
+        self.last_frame_end = None
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, milliseconds):
+        if name not in self.times:
+            self.times[name] = deque(maxlen=self.window)
+        self.times[name].append(milliseconds)
+
+    def end_frame(self):
+        now = time.perf_counter()
+        if self.enabled and self.last_frame_end is not None:
+            self.add(FRAME, (now - self.last_frame_end) * 1000)
+        self.last_frame_end = now
+        self.frames += 1
+
+    def skip_frame(self):
+        # the time since the last frame wasn't a frame, e.g. the main loop was idle
+        self.last_frame_end = None
+
+    def stats(self):
+        # phase name -> mean, median, 95th percentile and max in milliseconds
+        result = {}
+        for name, times in self.times.items():
+            values = np.fromiter(times, dtype=np.float64, count=len(times))
+            mean, p50, p95, top = (float(values.mean()), *np.percentile(values, (50, 95)).tolist(), float(values.max()))
+            result[name] = {"mean": mean, "p50": p50, "p95": p95, "max": top}
+        return result
+
+    def overlay_lines(self):
+        lines = ["phase        mean    p95    max  (ms)"]
+        for name, stat in self.stats().items():
+            lines.append(f"{name:10s} {stat['mean']:6.2f} {stat['p95']:6.2f} {stat['max']:6.2f}")
+        return lines
+
+    def dump(self, path):
+        with open(path, "w") as file:
+            json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "frames": self.frames,
+                       "window": self.window,
+                       "stats": self.stats(),
+                       "samples": {name: list(times) for name, times in self.times.items()}}, file, indent=2)
+
+    def reset(self):
+        self.times = {}
+        self.last_frame_end = None
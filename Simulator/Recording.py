@@ -0,0 +1,159 @@
+"""
+Recording and deterministic replay of interactive sessions
+
+While a Recorder is attached to an engine, every frame time passed to Update and every user action
+that changes the physics is written to a JSON lines file, in the order they happened:
+
+    {"seed": 123, "checkpoint": "session.jsonl.nbs", "scheduler": {...}, ...}   engine at the start
+    {"dt": 33}                                                                  one Update call
+    {"action": "speed", "amount": 10}                                           one action
+
+The bodies at the start are saved as a checkpoint next to the recording. replay feeds the frames and
+actions back to an engine without a display or frame rate cap; with the same seed for the engine's
+random numbers the replayed run is bit for bit the same as the recorded one.
+"""
+
+import json
+import os
+
+from CelestialBody import NewCelestialBody
+from Scheduler import FixedTimestepScheduler
+from Snapshot import save_checkpoint, restore_checkpoint
+from Vector import Vector2
+
+# Actions
+PAUSE = "pause"
+SPEED = "speed"
+INTEGRATOR = "integrator"
+BLOCK_TIMESTEPS = "block_timesteps"
+CREATE_BODY = "create_body"
+REMOVE_BODY = "remove_body"
+RESTORE = "restore"
+
+
+class Recorder:
+    def __init__(self, path, engine):
+        self.path = path
+        self.checkpoints = 0
+        self.checkpoint = path + ".nbs"
+        save_checkpoint(self.checkpoint, engine)
+        # start from a known state of everything that isn't in the checkpoint
+        engine.rng.seed(engine.seed)
+        engine.integrator.reset()
+        engine.block_stepper.reset()
+        scheduler = engine.scheduler
+        self.file = open(path, "w")
+        self._write({"seed": engine.seed,
+                     "checkpoint": os.path.basename(self.checkpoint),
+                     "scheduler": None if scheduler is None else {"step_ms": scheduler.step_ms,
+                                                                  "max_steps_per_frame": scheduler.max_steps_per_frame,
+                                                                  "accumulator": scheduler.accumulator},
+                     "paused": engine.isPaused,
+                     "vectorized": engine.vectorized,
+                     "block_timesteps": engine.block_timesteps,
+                     "collisions": engine.collisions,
+                     "theta": engine.theta,
+                     "fmm_order": engine.fmm_order,
+                     "softening": engine.softening,
+                     "workers": engine.workers})
+
+    def frame(self, delta_time):
+        self._write({"dt": delta_time})
+
+    def action(self, action, arguments=None):
+        self._write({"action": action, **(arguments or {})})
+
+    def restored(self, engine):
+        # the bodies were replaced from a checkpoint, keep a copy of what was loaded for the replay
+        self.checkpoints += 1
+        checkpoint = self.path + "." + str(self.checkpoints) + ".nbs"
+        save_checkpoint(checkpoint, engine)
+        self.action(RESTORE, {"checkpoint": os.path.basename(checkpoint)})
+
+    def _write(self, entry):
+        # floats are written with repr, so they read back exactly
+        self.file.write(json.dumps(entry) + "\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ReplayDisplay:
+    # the part of Display that SimulationEngine.Update talks to
+    def update(self, time, newBody, steps_per_second=0):
+        pass
+
+    def get_form_text(self, form_name):
+        return ""
+
+
+def read_recording(path):
+    # returns (header, events)
+    with open(path) as file:
+        header = json.loads(file.readline())
+        events = [json.loads(line) for line in file if line.strip()]
+    return header, events
+
+
+def replay(path, engine, on_frame=None):
+    # runs a recording on engine as fast as possible, returns the number of frames;
+    # on_frame(engine, frame) is called after every frame, e.g. to profile or sample it
+    header, events = read_recording(path)
+    restore_checkpoint(os.path.join(os.path.dirname(path), header["checkpoint"]), engine)
+    engine.seed = header["seed"]
+    engine.rng.seed(engine.seed)
+    engine.isPaused = header["paused"]
+    engine.vectorized = header["vectorized"]
+    engine.block_timesteps = header["block_timesteps"]
+    engine.collisions = header["collisions"]
+    engine.theta = header["theta"]
+    engine.fmm_order = header.get("fmm_order", engine.fmm_order)
+    engine.softening = header["softening"]
+    engine.workers = header["workers"]
+    engine.scheduler = None
+    if header["scheduler"] is not None:
+        settings = header["scheduler"]
+        engine.scheduler = FixedTimestepScheduler(1000 / settings["step_ms"], settings["max_steps_per_frame"])
+        engine.scheduler.step_ms = settings["step_ms"]
+        engine.scheduler.accumulator = settings["accumulator"]
+
+    display = ReplayDisplay()
+    frames = 0
+    for event in events:
+        if "dt" in event:
+            engine.Update(event["dt"], display)
+            frames += 1
+            if on_frame is not None:
+                on_frame(engine, frames)
+        else:
+            apply_action(engine, event, os.path.dirname(path))
+    return frames
+
+
+def apply_action(engine, event, directory=""):
+    action = event["action"]
+    if action == PAUSE:
+        engine.toggle_pause()
+    elif action == SPEED:
+        engine.change_sim_speed(event["amount"])
+    elif action == INTEGRATOR:
+        engine.next_integrator()
+    elif action == BLOCK_TIMESTEPS:
+        engine.toggle_block_timesteps()
+    elif action == CREATE_BODY:
+        body = NewCelestialBody()
+        body.name = event["name"]
+        body.pos = Vector2(*event["pos"])
+        body.radius = event["radius"]
+        body.gravity = event["gravity"]
+        body.initial_velocity = Vector2(*event["velocity"])
+        engine.new_celestial_body = body
+        engine.create_new_body()
+    elif action == REMOVE_BODY:
+        engine.delete_body(engine.bodies[event["index"]])
+    elif action == RESTORE:
+        restore_checkpoint(os.path.join(directory, event["checkpoint"]), engine)
+    else:
+        raise ValueError("Unknown action: " + str(action))
@@ -0,0 +1,202 @@
+"""
+Scenario files and procedural initial conditions
+
+Scenarios load straight into the engine's state arrays in chunks, no CelestialBody objects are made
+until something asks for them. Supported files:
+
+    .json   {"simulation_speed": 0.001, "central_body": "Sun",
+             "bodies": [{"name": "Sun", "pos": [0, 0], "vel": [0, 0], "mass": 1e13, "radius": 109, "color": "yellow"}],
+             "generators": [{"type": "plummer", "count": 10000, "seed": 1, "center": [5e4, 0]}]}
+            a body gives either "mass" or "surface_gravity" and "density" like CelestialBody
+    .csv    name,x,y,vx,vy,mass,radius[,color] with a header row, the format Headless writes
+    other   a checkpoint or trajectory from Snapshot, the last frame is loaded
+
+JSON is parsed in one go, so large scenarios should be CSV or binary files or use generators.
+
+The generators place bodies in the 2D gravity of this simulation, where the force falls off as 1/r:
+a circular orbit around an enclosed mass M has speed sqrt(G M) whatever its radius, and a
+virialised cluster has a velocity dispersion of sqrt(G M / 4) per axis.
+"""
+
+import csv
+import itertools
+import json
+import math
+
+import numpy as np
+
+from Snapshot import read_trajectory
+from Universe import Universe
+
+# Generated scenarios
+PLUMMER = "plummer"
+DISK = "disk"
+CLUSTER = "cluster"
+
+CHUNK_SIZE = 65536  # bodies added to the engine at a time while streaming a file
+
+
+def load_scenario(path, engine, chunk_size=CHUNK_SIZE):
+    # adds the bodies of a scenario file to engine, returns how many were added
+    start = engine.state.count
+    if path.endswith(".json"):
+        load_json(path, engine)
+    elif path.endswith(".csv"):
+        load_csv(path, engine, chunk_size)
+    else:
+        load_binary(path, engine, chunk_size)
+    return engine.state.count - start
+
+
+def load_json(path, engine):
+    with open(path) as file:
+        scenario = json.load(file)
+
+    bodies = scenario.get("bodies", [])
+    if bodies:
+        pos = np.array([body["pos"] for body in bodies], dtype=np.float64).reshape(-1, 2)
+        vel = np.array([body.get("vel", (0, 0)) for body in bodies], dtype=np.float64).reshape(-1, 2)
+        radius = np.array([body.get("radius", 1) for body in bodies], dtype=np.float64)
+        gravity = [body.get("surface_gravity", 1) for body in bodies]
+        # same mass as CelestialBody gives a body without an explicit one
+        mass = np.array([body["mass"] if "mass" in body else
+                         body.get("density", 1) * g * r * r / Universe.Big_G
+                         for body, g, r in zip(bodies, gravity, radius.tolist())], dtype=np.float64)
+        start = engine.add_bodies(pos, vel, mass, radius, [body.get("name") for body in bodies],
+                                  [body.get("color", "white") for body in bodies], gravity)
+        central = scenario.get("central_body")
+        if isinstance(central, str):
+            central = [body.get("name") for body in bodies].index(central)
+        if central is not None:
+            engine.central_body = engine.bodies[start + central]
+
+    for generator in scenario.get("generators", []):
+        parameters = dict(generator)
+        generate(engine, parameters.pop("type"), **parameters)
+
+    if "simulation_speed" in scenario:
+        engine.simulation_speed = scenario["simulation_speed"]
+
+
+def load_csv(path, engine, chunk_size=CHUNK_SIZE):
+    with open(path, newline="") as file:
+        columns = {name: i for i, name in enumerate(next(csv.reader([file.readline()])))}
+        numeric = [columns[name] for name in ("x", "y", "vx", "vy", "mass", "radius")]
+        text = [columns[name] for name in ("name", "color") if name in columns]
+        while True:
+            lines = list(itertools.islice(file, chunk_size))
+            if not lines:
+                break
+            values = np.loadtxt(lines, delimiter=",", quotechar='"', usecols=numeric, ndmin=2)
+            names = colors = None
+            if text:
+                strings = np.loadtxt(lines, dtype=str, delimiter=",", quotechar='"', usecols=text, ndmin=2)
+                if "name" in columns:
+                    names = strings[:, 0].tolist()
+                if "color" in columns:
+                    colors = strings[:, -1].tolist()
+            engine.add_bodies(values[:, 0:2], values[:, 2:4], values[:, 4], values[:, 5], names, colors)
+
+
+def load_binary(path, engine, chunk_size=CHUNK_SIZE):
+    metadata, frames = read_trajectory(path)
+    if len(frames) == 0:
+        return
+    # field views of the memory map, every chunk is read from disk only when it is copied in
+    pos, vel = frames["pos"][-1], frames["vel"][-1]
+    mass, radius = frames["mass"][-1], frames["radius"][-1]
+    names, colors = metadata.get("names"), metadata.get("colors")
+    gravity = metadata.get("surface_gravity")
+    start = engine.state.count
+    for begin in range(0, len(mass), chunk_size):
+        end = min(begin + chunk_size, len(mass))
+        engine.add_bodies(pos[begin:end], vel[begin:end], mass[begin:end], radius[begin:end],
+                          names[begin:end] if names else None,
+                          [color if isinstance(color, str) else tuple(color) for color in colors[begin:end]] if colors else None,
+                          gravity[begin:end] if gravity else None)
+    if metadata.get("central_body") is not None:
+        engine.central_body = engine.bodies[start + metadata["central_body"]]
+
+
+def generate(engine, kind, **parameters):
+    # adds a generated scenario to engine, returns the index of its first body
+    if kind == PLUMMER:
+        return engine.add_bodies(*plummer_sphere(**parameters))
+    if kind == CLUSTER:
+        return engine.add_bodies(*random_cluster(**parameters))
+    if kind == DISK:
+        pos, vel, mass, radius = disk_galaxy(**parameters)
+        # the first body is the core the disk orbits
+        start = engine.add_bodies(pos[:1], vel[:1], mass[:1], radius[:1], ["Core"], ["yellow"])
+        engine.add_bodies(pos[1:], vel[1:], mass[1:], radius[1:])
+        engine.central_body = engine.bodies[start]
+        return start
+    raise ValueError("Unknown generator: " + str(kind))
+
+
+def plummer_sphere(count=1000, total_mass=1e12, scale=1e4, body_radius=1, center=(0, 0), velocity=(0, 0), seed=None):
+    # the 2D Plummer profile, surface density falling as (1 + r^2 / scale^2)^-2, with isotropic velocities
+    rng = np.random.default_rng(seed)
+    # enclosed mass fraction is r^2 / (r^2 + scale^2), inverted; the far tail is cut off
+    u = rng.uniform(0, 0.99, count)
+    pos = _scatter(rng, scale * np.sqrt(u / (1 - u)))
+    mass = np.full(count, total_mass / count)
+    vel = rng.normal(0, _virial_dispersion(mass), (count, 2))
+    return _finish(pos, vel, mass, body_radius, center, velocity)
+
+
+def random_cluster(count=1000, total_mass=1e12, scale=1e4, body_radius=1, center=(0, 0), velocity=(0, 0), seed=None):
+    # bodies spread evenly over a disk of radius scale, random masses and virialised random velocities
+    rng = np.random.default_rng(seed)
+    pos = _scatter(rng, scale * np.sqrt(rng.uniform(0, 1, count)))
+    mass = rng.uniform(0.5, 1.5, count)
+    mass *= total_mass / mass.sum()
+    vel = rng.normal(0, _virial_dispersion(mass), (count, 2))
+    return _finish(pos, vel, mass, body_radius, center, velocity)
+
+
+def disk_galaxy(count=1000, total_mass=1e12, scale=1e4, core_fraction=0.5, dispersion=0.05, body_radius=1,
+                center=(0, 0), velocity=(0, 0), seed=None):
+    # a core body plus an exponential disk of count - 1 bodies on near circular orbits, counterclockwise
+    rng = np.random.default_rng(seed)
+    disk_count = count - 1
+    core_mass = total_mass * core_fraction if disk_count else total_mass
+    # exponential surface density with scale length scale / 3 has radii gamma(2) distributed
+    distance = rng.gamma(2, scale / 3, disk_count)
+    mass = np.full(disk_count, (total_mass - core_mass) / max(disk_count, 1))
+
+    # in 2D the pull of a round mass distribution only depends on the mass inside the orbit
+    order = np.argsort(distance)
+    enclosed = np.empty(disk_count)
+    enclosed[order] = core_mass + np.cumsum(mass[order]) - mass[order]
+    speed = np.sqrt(Universe.Big_G * enclosed)
+
+    pos = _scatter(rng, distance)
+    tangent = np.stack((-pos[:, 1], pos[:, 0]), axis=1) / np.maximum(distance, 1e-12)[:, np.newaxis]
+    vel = tangent * speed[:, np.newaxis] + rng.normal(0, 1, (disk_count, 2)) * (dispersion * speed)[:, np.newaxis]
+
+    pos = np.concatenate((np.zeros((1, 2)), pos))
+    vel = np.concatenate((np.zeros((1, 2)), vel))
+    mass = np.concatenate(((core_mass,), mass))
+    pos, vel, mass, radius = _finish(pos, vel, mass, body_radius, center, velocity)
+    radius[0] = body_radius * 10
+    return pos, vel, mass, radius
+
+
+def _scatter(rng, distance):
+    # points at the given distances from the origin in random directions
+    angle = rng.uniform(0, 2 * math.pi, len(distance))
+    return np.stack((distance * np.cos(angle), distance * np.sin(angle)), axis=1)
+
+
+def _virial_dispersion(mass):
+    # with a 1/r force 2 K = G (M^2 - sum m^2) / 2 in equilibrium, whatever the size of the system
+    total = mass.sum()
+    return math.sqrt(max(Universe.Big_G * (total * total - (mass * mass).sum()) / (4 * total), 0))
+
+
+def _finish(pos, vel, mass, body_radius, center, velocity):
+    # moves the system to center and velocity, with its centre of mass at rest there
+    pos = pos - np.average(pos, axis=0, weights=mass) + center
+    vel = vel - np.average(vel, axis=0, weights=mass) + velocity
+    return pos, vel, mass, np.full(len(mass), float(body_radius))
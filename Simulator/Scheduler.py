@@ -0,0 +1,43 @@
+"""
+Fixed timestep scheduling of physics steps, independent of the frame rate
+"""
+
+import time
+
+
+class FixedTimestepScheduler:
+    def __init__(self, physics_hz=1000, max_steps_per_frame=250):
+        self.step_ms = 1000 / physics_hz  # real time covered by one physics step (ms)
+        self.max_steps_per_frame = max_steps_per_frame
+        self.accumulator = 0.0
+        self.alpha = 0.0  # how far between the last two physics states the frame is, for interpolation
+        self.dropped_ms = 0.0  # time thrown away because the step budget ran out
+
+        # steps per second metric, measured over windows of about a second
+        self.steps_per_second = 0
+        self.window_steps = 0
+        self.window_start = time.perf_counter()
+
+    def advance(self, frame_ms):
+        # returns the number of physics steps to run for a frame that took frame_ms
+        self.accumulator += frame_ms
+        steps = int(self.accumulator // self.step_ms)
+        if steps > self.max_steps_per_frame:
+            # under load: run the budget and drop the backlog instead of spiralling
+            steps = self.max_steps_per_frame
+            self.dropped_ms += self.accumulator - steps * self.step_ms
+            self.accumulator = steps * self.step_ms
+        self.accumulator -= steps * self.step_ms
+        self.alpha = self.accumulator / self.step_ms
+
+        self.window_steps += steps
+        now = time.perf_counter()
+        if now - self.window_start >= 1:
+            self.steps_per_second = int(self.window_steps / (now - self.window_start))
+            self.window_steps = 0
+            self.window_start = now
+        return steps
+
+    def reset(self):
+        self.accumulator = 0.0
+        self.alpha = 0.0
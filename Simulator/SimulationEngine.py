@@ -1,30 +1,90 @@
 """
 Main Engine of simulation
 """
+import logging
 import math
+import os
 import random
+import time
 
-import pygame as p
-
+from BarnesHut import barnes_hut_accelerations, relative_error
+from BlockTimestep import BlockTimestepper
+from BodyList import BodyList
+from BodyState import BodyState
 from CelestialBody import CelestialBody, NewCelestialBody
+from Collisions import SpatialHash, merge_groups, merged_state
+from FastMultipole import fmm_accelerations, ORDER
+from Gravity import direct_accelerations
+from Integrator import INTEGRATORS, SemiImplicitEuler
+from ParallelForces import ParallelForceEvaluator
+from Recording import PAUSE, SPEED, INTEGRATOR, BLOCK_TIMESTEPS, CREATE_BODY, REMOVE_BODY
+from Scenario import PLUMMER, DISK, CLUSTER, generate, load_scenario
 from Vector import Vector2
+from TrailBuffer import TrailBuffer
 from Universe import Universe
 
+log = logging.getLogger(__name__)
+
+# Force backends
+DIRECT = "direct"
+BARNES_HUT = "barnes_hut"
+PARALLEL = "parallel"
+FMM = "fmm"
+
+# Built in scenarios
+BINARY = "binary"
+SOLAR = "solar"
+
 
 class SimulationEngine:
-    def __init__(self):
-        self.bodies: list[CelestialBody] = []
+    def __init__(self, vectorized=True, scenario=BINARY, seed=None):
+        # positions, velocities and masses of all bodies live in contiguous arrays
+        self.state = BodyState()
+        # vectorized mode steps all bodies at once on the state arrays instead of body by body
+        self.vectorized = vectorized
+        self.force_backend = DIRECT
+        self.theta = 0.5  # Barnes-Hut opening angle, smaller is more accurate and slower
+        self.fmm_order = ORDER  # terms of the fast multipole expansions, larger is more accurate and slower
+        self.softening = Universe.Softening
+        # overlapping bodies merge into one
+        self.collisions = True
+        self.spatial_hash = SpatialHash()
+        self.workers = None  # worker processes for the parallel backend, None uses every core
+        self.parallel_evaluator = None
+        self.integrator = SemiImplicitEuler()
+        # per body power of two timesteps, replaces the integrator when enabled
+        self.block_timesteps = False
+        self.block_stepper = BlockTimestepper()
         self.delta_time = 0
+        self.sim_time = 0.0  # total simulated time
+        self.bodies_version = 0  # changes whenever a body is added or removed
         self.simulation_speed = 0.001
         self.isPaused = True
+        # optional FixedTimestepScheduler, without one every Update is a single step of the frame time
+        self.scheduler = None
+        self.render_alpha = 1.0
+        self.diagnostics = None  # optional Diagnostics, sampled after the steps
+        self.record_trails = True  # trails are only needed when something draws them
+        self.trails = TrailBuffer()
+        # CelestialBody objects are views into the state arrays, made when first needed
+        self.bodies = BodyList(self.state, self.trails)
         self.central_body: CelestialBody = None
-        # self.create_solar_system()
-        self.create_binary_system()
+        # every random choice comes from rng, a run with the same seed and inputs is the same run
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+        self.recorder = None  # optional Recorder that logs the frame times and user actions
+        self.create_scenario(scenario)
 
         self.new_celestial_body = NewCelestialBody()
         self.new_in_progress = False
+        self.new_body_stats = None  # last logged values of the new body
+
+    def record(self, action, **arguments):
+        if self.recorder is not None:
+            self.recorder.action(action, arguments)
 
     def toggle_pause(self):
+        self.record(PAUSE)
         self.isPaused = not self.isPaused
 
     def toggle_new_body(self):
@@ -33,25 +93,191 @@ class SimulationEngine:
             self.new_celestial_body = NewCelestialBody()
 
     def change_sim_speed(self, amount):
+        self.record(SPEED, amount=amount)
         new_speed = self.simulation_speed * amount
-        if 0.0000001 <= new_speed <= 0.001:
+        if 0.0000001 <= new_speed <= self.max_simulation_speed():
             self.simulation_speed = new_speed
 
+    def max_simulation_speed(self):
+        # higher order integrators stay stable with larger steps
+        return 0.001 * self.integrator.max_speed_factor
+
+    def set_integrator(self, name):
+        self.integrator = INTEGRATORS[name]()
+        if self.simulation_speed > self.max_simulation_speed():
+            self.simulation_speed = self.max_simulation_speed()
+
+    def next_integrator(self):
+        self.record(INTEGRATOR)
+        names = list(INTEGRATORS)
+        self.set_integrator(names[(names.index(self.integrator.name) + 1) % len(names)])
+
+    def toggle_block_timesteps(self):
+        self.record(BLOCK_TIMESTEPS)
+        self.block_timesteps = not self.block_timesteps
+        # the stepper's cached accelerations are from before the other integrator moved the bodies
+        self.block_stepper.reset()
+
     def Update(self, delta_time, display):
+        if self.recorder is not None:
+            self.recorder.frame(delta_time)
         self.delta_time = delta_time
         # print(self.central_body)
         # print("Delta time: " + str(self.delta_time) + "ms")
-        if not self.isPaused:
+        if self.scheduler is None:
+            self.step(delta_time)
+        else:
+            # run as many fixed size steps as the elapsed time needs
+            steps = self.scheduler.advance(0 if self.isPaused else delta_time)
+            for _ in range(steps):
+                self.step(self.scheduler.step_ms)
+            self.render_alpha = self.scheduler.alpha
+
+        steps_per_second = self.scheduler.steps_per_second if self.scheduler is not None else 0
+        display.update(delta_time, self.new_in_progress, steps_per_second)
+
+        self.update_new_body(display)
+
+    def step(self, delta_time):
+        # advance the physics by delta_time ms of real time, scaled by the simulation speed
+        if self.isPaused:
+            return
+        self.advance(delta_time * self.simulation_speed)
+
+    def advance(self, time_step):
+        # advance the physics by time_step of simulation time, no pausing, display or speed scaling
+        if self.diagnostics is not None:
+            start = time.perf_counter()
+        self.sim_time += time_step
+        self.state.save_previous()
+        if self.vectorized:
+            self.step_vectorized(time_step)
+        else:
             for body in self.bodies:
                 acceleration = self.calculate_acceleration(body.pos, body)
-                body.UpdateVelocity(acceleration, self.delta_time * self.simulation_speed)
+                body.UpdateVelocity(acceleration, time_step)
 
             for body in self.bodies:
-                body.UpdatePosition(self.delta_time * self.simulation_speed)
+                body.UpdatePosition(time_step)
+        if self.collisions:
+            self.resolve_collisions()
+        if self.record_trails:
+            self.trails.record(self.state.pos)
+        if self.diagnostics is not None:
+            self.diagnostics.record_step(self, time.perf_counter() - start)
 
-        display.update(delta_time, self.new_in_progress)
+    def render_positions(self):
+        # body positions to draw, interpolated between the last two physics steps
+        return self.state.interpolated_pos(self.render_alpha)
 
-        self.update_new_body(display)
+    def step_vectorized(self, time_step):
+        mass = self.state.mass
+        # accelerations kept from the last step are only reused while these settings stay the same
+        force_key = self.force_backend, self.softening, self.theta, self.fmm_order
+        if self.block_timesteps:
+            self.block_stepper.step(self.state.pos, self.state.vel, time_step,
+                                    lambda pos, targets: self.accelerations(pos, mass, targets), force_key)
+        else:
+            self.integrator.step(self.state.pos, self.state.vel, time_step, lambda pos: self.accelerations(pos, mass),
+                                 force_key)
+
+    def compute_accelerations(self, targets=None):
+        return self.accelerations(self.state.pos, self.state.mass, targets)
+
+    def accelerations(self, pos, mass, targets=None):
+        # accelerations with the selected force backend, also used for arrays other than the engine state
+        if self.force_backend == BARNES_HUT:
+            return barnes_hut_accelerations(pos, mass, Universe.Big_G, self.theta, targets, self.softening)
+        if self.force_backend == FMM:
+            return fmm_accelerations(pos, mass, Universe.Big_G, self.fmm_order, targets, self.softening)
+        if self.force_backend == PARALLEL:
+            if self.parallel_evaluator is None or self.parallel_evaluator.workers != (self.workers or os.cpu_count()):
+                self.close()
+                self.parallel_evaluator = ParallelForceEvaluator(self.workers)
+            return self.parallel_evaluator.accelerations(pos, mass, Universe.Big_G, targets, self.softening)
+        return direct_accelerations(pos, mass, Universe.Big_G, targets, self.softening)
+
+    def close(self):
+        # release the worker processes and shared memory of the parallel backend
+        if self.parallel_evaluator is not None:
+            self.parallel_evaluator.close()
+            self.parallel_evaluator = None
+
+    def check_force_accuracy(self):
+        # compare the selected backend against the exact direct sum, returns (max, mean) relative error
+        approximate = self.compute_accelerations()
+        exact = direct_accelerations(self.state.pos, self.state.mass, Universe.Big_G, softening=self.softening)
+        error = relative_error(approximate, exact)
+        if len(error) == 0:
+            return 0.0, 0.0
+        return float(error.max()), float(error.mean())
+
+    def clear(self):
+        self.state = BodyState()
+        # ids carry on from the old bodies so that they are never reused
+        self.bodies = BodyList(self.state, self.trails, self.bodies.next_id)
+        self.trails.configure(self.trails.length, self.trails.decimation)
+        self.central_body = None
+        self.bodies_version += 1
+        self.block_stepper.reset()
+        self.integrator.reset()
+
+    def resolve_collisions(self):
+        first, second = self.spatial_hash.overlapping_pairs(self.state.pos, self.state.radius)
+        if len(first) == 0:
+            return
+        # merge with the rows as they are now, then remove, removal reorders the rows
+        merges = []
+        for group in merge_groups(first, second):
+            merged = merged_state(self.state.pos[group], self.state.vel[group],
+                                  self.state.mass[group], self.state.radius[group])
+            merges.append((sorted((self.bodies[i] for i in group), key=lambda body: -body.mass), merged))
+        for (survivor, *others), (pos, vel, mass, radius) in merges:
+            survivor.pos = Vector2(*pos.tolist())
+            survivor.velocity = Vector2(*vel.tolist())
+            survivor.mass = mass
+            survivor.radius = radius
+            for body in others:
+                if body is self.central_body:
+                    self.central_body = survivor
+                self.remove_body(body)
+
+    def remove_body(self, body: CelestialBody):
+        index = body.index
+        body.detach()
+        moved = self.state.remove(index)
+        self.bodies.swap_remove(index)
+        if moved is not None:
+            # the last body took the removed one's place
+            self.trails.move_row(moved, index)
+        if body is self.central_body:
+            self.central_body = None
+        self.bodies_version += 1
+        self.block_stepper.reset()
+        self.integrator.reset()
+
+    def delete_body(self, body: CelestialBody):
+        # remove_body asked for by the user, collisions remove bodies without going through here
+        self.record(REMOVE_BODY, index=body.index)
+        self.remove_body(body)
+
+    def add_body(self, body: CelestialBody):
+        index = self.state.add(body.pos.tuple(), body.velocity.tuple(), body.mass, body.radius)
+        body.attach(self.state, index, self.trails)
+        self.trails.clear_row(index)
+        self.bodies.append(body)
+        self.bodies_version += 1
+        self.block_stepper.reset()
+        return body
+
+    def add_bodies(self, pos, vel, mass, radius, names=None, colors=None, surface_gravity=None):
+        # bulk version of add_body straight from arrays, the CelestialBody objects are only made on access
+        start = self.state.add_many(pos, vel, mass, radius)
+        self.trails.clear_rows(start, self.state.count)
+        self.bodies.extend_rows(self.state.count - start, names, colors, surface_gravity)
+        self.bodies_version += 1
+        self.block_stepper.reset()
+        return start
 
     def update_new_body(self, display):
         if self.new_in_progress:
@@ -96,104 +322,119 @@ class SimulationEngine:
                 vel = Vector2.zero()
             self.new_celestial_body.initial_velocity = vel
 
-            print("Updated the new celestial body stats:")
-            print("name: " + self.new_celestial_body.name)
-            print("radius: " + str(self.new_celestial_body.radius))
-            print("gravity: " + str(self.new_celestial_body.gravity))
-            print("position: " + str(self.new_celestial_body.pos))
-            print("velocity: " + str(self.new_celestial_body.initial_velocity))
+            stats = (self.new_celestial_body.name, self.new_celestial_body.radius, self.new_celestial_body.gravity,
+                     str(self.new_celestial_body.pos), str(self.new_celestial_body.initial_velocity))
+            if stats != self.new_body_stats:
+                # only when something changed, not every frame
+                self.new_body_stats = stats
+                log.debug("New celestial body: name %s, radius %s, gravity %s, position %s, velocity %s", *stats)
 
     def create_new_body(self):
-        print("Creating new body!")
+        log.info("Creating new body %s", self.new_celestial_body.name)
+        self.record(CREATE_BODY, name=self.new_celestial_body.name, pos=self.new_celestial_body.pos.tuple(),
+                    radius=self.new_celestial_body.radius, gravity=self.new_celestial_body.gravity,
+                    velocity=self.new_celestial_body.initial_velocity.tuple())
         colors = ("blue", "red", "orange", "brown", "yellow", "green", "darkblue", "pink")
         newBody = CelestialBody(self.new_celestial_body.pos,
                                 self.new_celestial_body.radius,
                                 self.new_celestial_body.gravity, 1,
                                 self.new_celestial_body.initial_velocity,
                                 self.new_celestial_body.name,
-                                p.Color(colors[random.randint(0, len(colors) - 1)]))
-        self.bodies.append(newBody)
+                                colors[self.rng.randint(0, len(colors) - 1)])
+        self.add_body(newBody)
         self.new_celestial_body = NewCelestialBody()
         self.new_in_progress = False
 
+    def create_scenario(self, scenario):
+        if scenario == BINARY:
+            self.create_binary_system()
+        elif scenario == SOLAR:
+            self.create_solar_system()
+        elif scenario in (PLUMMER, DISK, CLUSTER):
+            generate(self, scenario, seed=self.seed)
+        elif scenario is not None and os.path.exists(scenario):
+            load_scenario(scenario, self)
+        elif scenario is not None:
+            raise ValueError("Unknown scenario: " + str(scenario))
+
     def create_solar_system(self):
         # data for ratio between distances from https://nssdc.gsfc.nasa.gov/planetary/factsheet/planet_table_ratio.html
         sun_radius = 109
         # earth radius is 1
         # earth mass is 1
         # earth density is 1
-        self.bodies.append(CelestialBody(Vector2(0, 0), sun_radius, 333000, 0.26, Vector2(12000, 0), "Sun", p.Color("yellow")))
+        self.add_body(CelestialBody(Vector2(0, 0), sun_radius, 333000, 0.26, Vector2(12000, 0), "Sun", "yellow"))
         self.central_body = self.bodies[0]
 
         earth_pos = Vector2(sun_radius * 215, 0)
-        self.bodies.append(CelestialBody(earth_pos, 1, 1, 1, self.get_init_velocity_for_circular_orbit(self.bodies[0], earth_pos) * 155, "Earth", p.Color("blue")))
+        self.add_body(CelestialBody(earth_pos, 1, 1, 1, self.get_init_velocity_for_circular_orbit(self.bodies[0], earth_pos) * 155, "Earth", "blue"))
 
         """
         moon_pos = earth_pos + Vector2(60, 0)
-        self.bodies.append(CelestialBody(moon_pos, 0.27, 0.17, 0.6,
-                                         self.get_init_velocity_for_circular_orbit(self.bodies[0], moon_pos) * 160 +
-                                         self.get_init_velocity_for_circular_orbit(self.bodies[1], moon_pos - earth_pos) * 20,
-                                         "Moon", p.Color("grey")))
+        self.add_body(CelestialBody(moon_pos, 0.27, 0.17, 0.6,
+                                    self.get_init_velocity_for_circular_orbit(self.bodies[0], moon_pos) * 160 +
+                                    self.get_init_velocity_for_circular_orbit(self.bodies[1], moon_pos - earth_pos) * 20,
+                                    "Moon", "grey"))
         """
 
         mercury_pos = Vector2(sun_radius * 66, 0)
-        self.bodies.append(
+        self.add_body(
             CelestialBody(mercury_pos, 0.38, 0.38, 0.99, self.get_init_velocity_for_circular_orbit(self.bodies[0], mercury_pos) * 90,
-                          "Mercury", p.Color("grey")))
+                          "Mercury", "grey"))
 
         venus_pos = Vector2(sun_radius * 155, 0)
-        self.bodies.append(
+        self.add_body(
             CelestialBody(venus_pos, 0.95, 0.91, 0.95,
                           self.get_init_velocity_for_circular_orbit(self.bodies[0], venus_pos) * 130,
-                          "Venus", p.Color("burlywood4")))
+                          "Venus", "burlywood4"))
 
         mars_pos = earth_pos * 1.5
-        self.bodies.append(
+        self.add_body(
             CelestialBody(mars_pos, 0.53, 0.38, 0.71,
                           self.get_init_velocity_for_circular_orbit(self.bodies[0], mars_pos) * 190,
-                          "Mars", p.Color("red")))
+                          "Mars", "red"))
 
         jupiter_pos = earth_pos * 5.2
-        self.bodies.append(
+        self.add_body(
             CelestialBody(jupiter_pos, 11, 2.4, 0.24,
                           self.get_init_velocity_for_circular_orbit(self.bodies[0], jupiter_pos) * 350,
-                          "Jupiter", p.Color("bisque3")))
+                          "Jupiter", "bisque3"))
 
         saturn_pos = earth_pos * 9.6
-        self.bodies.append(
+        self.add_body(
             CelestialBody(saturn_pos, 9.5, 0.92, 0.13,
                           self.get_init_velocity_for_circular_orbit(self.bodies[0], saturn_pos) * 450,
-                          "Saturn", p.Color("bisque")))
+                          "Saturn", "bisque"))
 
         uranus_pos = earth_pos * 19.2
-        self.bodies.append(
+        self.add_body(
             CelestialBody(uranus_pos, 4, 0.89, 0.23,
                           self.get_init_velocity_for_circular_orbit(self.bodies[0], uranus_pos) * 650,
-                          "Uranus", p.Color("cadetblue1")))
+                          "Uranus", "cadetblue1"))
 
         neptune_pos = earth_pos * 30.2
-        self.bodies.append(
+        self.add_body(
             CelestialBody(neptune_pos, 3.9, 1.1, 0.30,
                           self.get_init_velocity_for_circular_orbit(self.bodies[0], neptune_pos) * 800,
-                          "Neptune", p.Color("cadetblue4")))
+                          "Neptune", "cadetblue4"))
 
     def create_binary_system(self):
-        self.bodies.append(
-            CelestialBody(Vector2(0, 0), 200, 333000, 0.26, Vector2(0, 20000), "Sun", p.Color("yellow")))
-        self.bodies.append(
-            CelestialBody(Vector2(100000, 0), 200, 333000, 0.26, Vector2(0, -20000), "Sun2", p.Color("blue")))
-        self.bodies.append(
+        self.add_body(
+            CelestialBody(Vector2(0, 0), 200, 333000, 0.26, Vector2(0, 20000), "Sun", "yellow"))
+        self.add_body(
+            CelestialBody(Vector2(100000, 0), 200, 333000, 0.26, Vector2(0, -20000), "Sun2", "blue"))
+        self.add_body(
             CelestialBody(Vector2(500000, 0), 3.9, 1.1, 0.30,
                           Vector2(0, -80000),
-                          "Planet", p.Color("red")))
-        self.bodies.append(
+                          "Planet", "red"))
+        self.add_body(
             CelestialBody(Vector2(250000, 0), 3.9, 1.1, 0.30,
                           Vector2(0, -40000),
-                          "Planet", p.Color("green")))
-        self.bodies.append(
+                          "Planet", "green"))
+        self.add_body(
             CelestialBody(Vector2(10000, 0), 3.9, 1.1, 0.30,
                           Vector2(0, -8000),
-                          "Planet", p.Color("chocolate")))
+                          "Planet", "chocolate"))
 
     @staticmethod
     def get_init_velocity_for_circular_orbit(parent: CelestialBody, pos: Vector2):
@@ -203,16 +444,16 @@ class SimulationEngine:
         child_angle_to_parent = child_pos_unit_vector.angle()
         init_velocity = Vector2(math.sin(child_angle_to_parent) * child_pos_unit_vector.y * wanted_speed,
                                 -math.cos(child_angle_to_parent) * child_pos_unit_vector.x * wanted_speed)
-        print("magnitude:", init_velocity.magnitude(), "wanted speed:", wanted_speed)
+        log.debug("magnitude: %s wanted speed: %s", init_velocity.magnitude(), wanted_speed)
         return init_velocity
 
     def calculate_acceleration(self, point: Vector2, ignore_body):
         acceleration = Vector2.zero()
         for otherBody in self.bodies:
-            if otherBody != ignore_body:
-                square_distance = (otherBody.pos - point).magnitude()
-                force_direction = (otherBody.pos - point).normalize()
-                # print(force_direction)
-                acceleration += force_direction * Universe.Big_G * otherBody.mass / square_distance
+            if otherBody is not ignore_body:
+                other_pos = otherBody.pos
+                square_distance = point.distance_squared(other_pos) + self.softening * self.softening
+                # direction / distance * G * m, i.e. (other - point) * G * m / distance^2 (softened)
+                acceleration.scaled_add(other_pos - point, Universe.Big_G * otherBody.mass / square_distance)
                 # print("Acceleration: " + str(acceleration))
         return acceleration
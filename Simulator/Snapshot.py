@@ -0,0 +1,154 @@
+"""
+Binary snapshot format for checkpoints and trajectories
+
+A file is a fixed size header, a JSON metadata block and any number of frames appended after it:
+
+    header    64 bytes  magic, version, body count, metadata length
+    metadata  JSON      names, colors and engine settings, padded to 8 bytes
+    frames    time, pos[count, 2], vel[count, 2], mass[count], radius[count] as little endian float64
+
+Every frame has the same size, so the frames of a file can be memory mapped as one structured array
+without reading it into RAM. A checkpoint is a file with a single frame.
+"""
+
+import json
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+MAGIC = b"NBODYSIM"
+VERSION = 1
+HEADER = struct.Struct("<8sIQQ")
+HEADER_SIZE = 64
+
+
+def frame_dtype(count):
+    return np.dtype([("time", "<f8"), ("pos", "<f8", (count, 2)), ("vel", "<f8", (count, 2)),
+                     ("mass", "<f8", (count,)), ("radius", "<f8", (count,))])
+
+
+def write_header(file, count, metadata):
+    encoded = json.dumps(metadata).encode()
+    encoded += b" " * (-len(encoded) % 8)
+    file.write(HEADER.pack(MAGIC, VERSION, count, len(encoded)).ljust(HEADER_SIZE, b"\0"))
+    file.write(encoded)
+    return HEADER_SIZE + len(encoded)
+
+
+def read_header(file):
+    # returns (body count, metadata, offset of the first frame)
+    magic, version, count, metadata_length = HEADER.unpack(file.read(HEADER_SIZE)[:HEADER.size])
+    if magic != MAGIC:
+        raise ValueError("Not a snapshot file")
+    if version != VERSION:
+        raise ValueError("Unsupported snapshot version: " + str(version))
+    metadata = json.loads(file.read(metadata_length).decode())
+    return count, metadata, HEADER_SIZE + metadata_length
+
+
+def make_frame(count, time, pos, vel, mass, radius):
+    frame = np.zeros(1, dtype=frame_dtype(count))
+    frame["time"] = time
+    frame["pos"] = pos
+    frame["vel"] = vel
+    frame["mass"] = mass
+    frame["radius"] = radius
+    return frame
+
+
+def engine_metadata(engine):
+    central_index = engine.central_body.index if engine.central_body is not None else None
+    return {"names": engine.bodies.names(),
+            "colors": [color if isinstance(color, str) else tuple(color) for color in engine.bodies.colors()],
+            "surface_gravity": engine.bodies.surface_gravity(),
+            "central_body": central_index,
+            "simulation_speed": engine.simulation_speed,
+            "integrator": engine.integrator.name,
+            "force_backend": engine.force_backend}
+
+
+def save_checkpoint(path, engine):
+    state = engine.state
+    frame = make_frame(state.count, engine.sim_time, state.pos, state.vel, state.mass, state.radius)
+    # write next to the old checkpoint and swap, so a crash mid write never leaves a broken file
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        write_header(file, state.count, engine_metadata(engine))
+        file.write(frame.tobytes())
+    os.replace(temporary, path)
+
+
+def restore_checkpoint(path, engine):
+    # replaces the bodies of engine with the ones saved in the checkpoint
+    metadata, frames = read_trajectory(path)
+    frame = frames[-1]
+    engine.clear()
+    engine.add_bodies(frame["pos"], frame["vel"], frame["mass"], frame["radius"], metadata["names"],
+                      [color if isinstance(color, str) else tuple(color) for color in metadata["colors"]],
+                      metadata["surface_gravity"])
+    if metadata.get("central_body") is not None:
+        engine.central_body = engine.bodies[metadata["central_body"]]
+    engine.sim_time = float(frame["time"])
+    engine.simulation_speed = metadata.get("simulation_speed", engine.simulation_speed)
+    engine.set_integrator(metadata.get("integrator", engine.integrator.name))
+    engine.force_backend = metadata.get("force_backend", engine.force_backend)
+
+
+def read_trajectory(path):
+    # returns (metadata, frames) with frames memory mapped, read only
+    with open(path, "rb") as file:
+        count, metadata, offset = read_header(file)
+    dtype = frame_dtype(count)
+    frame_count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if frame_count == 0:
+        return metadata, np.zeros(0, dtype=dtype)
+    # a frame cut short by a crash is ignored
+    return metadata, np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(frame_count,))
+
+
+class TrajectoryWriter:
+    # append only trajectory file, frames are written from a background thread so the step loop never waits on disk
+
+    def __init__(self, path, engine, max_queued=64):
+        self.count = engine.state.count
+        self.dtype = frame_dtype(self.count)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # resume: keep the frames that are already there
+            with open(path, "rb") as file:
+                count, _, offset = read_header(file)
+            if count != self.count:
+                raise ValueError("Trajectory file has " + str(count) + " bodies, engine has " + str(self.count))
+            frame_count = (os.path.getsize(path) - offset) // self.dtype.itemsize
+            self.file = open(path, "r+b")
+            self.file.truncate(offset + frame_count * self.dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, "wb")
+            write_header(self.file, self.count, engine_metadata(engine))
+        self.queue = queue.Queue(max_queued)
+        self.thread = threading.Thread(target=self._write_frames, daemon=True)
+        self.thread.start()
+
+    def append(self, engine):
+        state = engine.state
+        if state.count != self.count:
+            raise ValueError("The number of bodies changed while recording a trajectory")
+        # the copy is the only work done on the calling thread
+        self.queue.put(make_frame(self.count, engine.sim_time, state.pos, state.vel, state.mass, state.radius))
+
+    def _write_frames(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            self.file.write(frame.tobytes())
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.file.close()
@@ -0,0 +1,72 @@
+"""
+Contains class TrailBuffer, fixed capacity ring buffer of trail points for all bodies
+"""
+
+import numpy as np
+
+
+class TrailBuffer:
+    def __init__(self, length=100, decimation=1, capacity=16):
+        self.length = max(2, length)  # points kept per body
+        self.decimation = max(1, decimation)  # record every decimation-th step
+        self.points = np.zeros((max(1, capacity), self.length, 2))
+        self.counts = np.zeros(max(1, capacity), dtype=np.int64)  # valid points per body
+        self.head = 0  # slot the next points go to, shared by all bodies
+        self.steps = 0
+
+    def configure(self, length, decimation=1):
+        # changing the length throws the recorded trails away
+        self.length = max(2, length)
+        self.decimation = max(1, decimation)
+        self.points = np.zeros((len(self.points), self.length, 2))
+        self.counts[:] = 0
+        self.head = 0
+
+    def reserve(self, capacity):
+        if capacity <= len(self.points):
+            return
+        new_capacity = len(self.points)
+        while new_capacity < capacity:
+            new_capacity *= 2
+        points = np.zeros((new_capacity, self.length, 2))
+        points[:len(self.points)] = self.points
+        counts = np.zeros(new_capacity, dtype=np.int64)
+        counts[:len(self.counts)] = self.counts
+        self.points = points
+        self.counts = counts
+
+    # rows past the capacity have no points yet, the buffer only grows when recording needs it
+    def clear_row(self, index):
+        self.clear_rows(index, index + 1)
+
+    def clear_rows(self, start, end):
+        self.counts[start:end] = 0
+
+    def move_row(self, source, destination):
+        if destination >= len(self.counts):
+            return
+        if source >= len(self.counts):
+            self.counts[destination] = 0
+            return
+        self.points[destination] = self.points[source]
+        self.counts[destination] = self.counts[source]
+
+    def record(self, positions):
+        self.steps += 1
+        if self.steps % self.decimation:
+            return
+        n = len(positions)
+        self.reserve(n)
+        self.points[:n, self.head] = positions
+        np.minimum(self.counts[:n] + 1, self.length, out=self.counts[:n])
+        self.head = (self.head + 1) % self.length
+
+    def get(self, index):
+        # the trail of one body, oldest point first
+        if index >= len(self.counts):
+            return self.points[0, :0]
+        count = int(self.counts[index])
+        if count == self.length:
+            return np.concatenate((self.points[index, self.head:], self.points[index, :self.head]))
+        order = (self.head - count + np.arange(count)) % self.length
+        return self.points[index, order]
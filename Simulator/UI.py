@@ -2,10 +2,22 @@
 Contains UI elements
 """
 
+import logging
 
 from Vector import Vector2
 import pygame as p
 
+log = logging.getLogger(__name__)
+
+# fonts by size, shared by all UI objects
+_fonts = {}
+
+
+def get_font(size):
+    if size not in _fonts:
+        _fonts[size] = p.font.Font('freesansbold.ttf', size)
+    return _fonts[size]
+
 
 class UI_Object:
     def __init__(self, name, pos: Vector2, size, color=p.Color("white"), is_circle=False, function=None):
@@ -23,10 +35,24 @@ class UI_Object:
         self.type = "ui"
         self.image: p.image = None
         self.is_clickable = False
+        # last rendered text and its surface, rendered again only when the text or color changes
+        self._text_key = None
+        self._text_surface = None
 
     def do_function(self):
         self.function()
 
+    def render_text(self, text, color):
+        key = (text, self.bold, color if isinstance(color, str) else tuple(color))
+        if key != self._text_key:
+            self._text_key = key
+            self._text_surface = self.font.render(text, self.bold, color)
+        return self._text_surface
+
+    def render_key(self):
+        # changes whenever the object would look different, used to cache composited UI
+        return self.show,
+
     def draw(self, screen):
         if self.image is not None:
             screen.blit(self.image, self.position.tuple())
@@ -60,7 +86,7 @@ class UI_Object:
         else:
             if self.position.x - self.width // 2 <= vector_mouse.x <= self.position.x + self.width // 2 and \
                     self.position.y - self.height // 2 <= vector_mouse.y <= self.position.y + self.height // 2:
-                print("clicked on: " + self.name)
+                log.debug("clicked on: %s", self.name)
                 return True
         return False
 
@@ -78,13 +104,16 @@ class Button(UI_Object):
         self.prompt_text = ""
         self.text_color = p.Color("black")
         self.text_size = min(self.width, self.height) // 2  # tweak this for better text fitting
-        self.font = p.font.Font('freesansbold.ttf', self.text_size)
+        self.font = get_font(self.text_size)
         self.bold = False
 
+    def render_key(self):
+        return self.show, self.prompt_text, self.time_until_not_clicked > 0
+
     def draw(self, screen):
         super().draw(screen)
 
-        text_surface = self.font.render(self.prompt_text, self.bold, self.text_color)
+        text_surface = self.render_text(self.prompt_text, self.text_color)
         text_rect = text_surface.get_rect()
         text_rect.center = self.position.tuple()
         screen.blit(text_surface, text_rect)
@@ -120,14 +149,18 @@ class TextObject(UI_Object):
         super().__init__(name, pos, size, function=text_function)
         self.text = text
         self.text_size = min(self.width, self.height) // 2  # tweak this for better text fitting
-        self.font = p.font.Font('freesansbold.ttf', self.text_size)
+        self.font = get_font(self.text_size)
         self.bold = False
 
+    def render_key(self):
+        return self.show, self.text
+
     def draw(self, screen):
-        text_surface = self.font.render(self.text, self.bold, self.color)
+        # returns the area drawn to
+        text_surface = self.render_text(self.text, self.color)
         text_rect = text_surface.get_rect()
         text_rect.center = self.position.tuple()
-        screen.blit(text_surface, text_rect)
+        return screen.blit(text_surface, text_rect)
 
     def do_function(self):
         self.text = self.function()
@@ -153,7 +186,7 @@ class Form(TextObject):
         if event.type == p.MOUSEBUTTONDOWN:
             if self.get_clicked(mouse):
                 self.active = not self.active
-                print("Clicked on this form: " + self.name)
+                log.debug("Clicked on this form: %s", self.name)
                 updated_this = True
             else:
                 self.active = False
@@ -172,14 +205,17 @@ class Form(TextObject):
 
         return updated_this
 
+    def render_key(self):
+        return self.show, self.prompt_text, self.text, self.active
+
     def draw(self, screen):
-        text_surface = self.font.render(self.prompt_text + self.text, self.bold, self.color)
+        text_surface = self.render_text(self.prompt_text + self.text, self.color)
         text_rect = text_surface.get_rect()
         text_rect.center = self.position.tuple()
-        screen.blit(text_surface, text_rect)
-        p.draw.rect(screen, self.active_color,
-                    p.Rect(self.position.x - self.width // 2, self.position.y - self.height // 2,
-                           self.width, self.height), 4)
+        drawn = screen.blit(text_surface, text_rect)
+        return drawn.union(p.draw.rect(screen, self.active_color,
+                                       p.Rect(self.position.x - self.width // 2, self.position.y - self.height // 2,
+                                              self.width, self.height), 4))
 
 
 
@@ -1,2 +1,3 @@
 class Universe:
     Big_G = 0.0001
+    Softening = 1.0  # gravity softening length, keeps forces finite when bodies overlap
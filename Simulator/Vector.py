@@ -1,7 +1,11 @@
 import math
 
+import numpy as np
+
 
 class Vector2:
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -14,9 +18,27 @@ class Vector2:
     def one():
         return Vector2(1, 1)
 
+    def copy(self):
+        return Vector2(self.x, self.y)
+
     def magnitude(self):
         return math.sqrt((self.x * self.x) + (self.y * self.y))
 
+    def magnitude_squared(self):
+        return (self.x * self.x) + (self.y * self.y)
+
+    def distance(self, other):
+        return math.sqrt(self.distance_squared(other))
+
+    def distance_squared(self, other):
+        # |other - self|^2 without building the difference vector
+        dx = other.x - self.x
+        dy = other.y - self.y
+        return dx * dx + dy * dy
+
+    def dot(self, other):
+        return self.x * other.x + self.y * other.y
+
     def normalize(self):
         m = self.magnitude()
         if m > 0:
@@ -24,6 +46,12 @@ class Vector2:
             return Vector2(self.x / m, self.y / m)
         return Vector2.zero()
 
+    def scaled_add(self, other, scale):
+        # self += other * scale in place, without the temporary
+        self.x += other.x * scale
+        self.y += other.y * scale
+        return self
+
     def tuple(self):
         return tuple((self.x, self.y))
 
@@ -58,5 +86,137 @@ class Vector2:
             return Vector2(self.x / other.x, self.y / other.y)
         return Vector2(self.x / other, self.y / other)
 
+    def __neg__(self):
+        return Vector2(-self.x, -self.y)
+
+    # in place versions, these change the vector instead of allocating a new one
+    def __iadd__(self, other):
+        if not isinstance(other, Vector2):
+            return NotImplemented
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def __isub__(self, other):
+        if not isinstance(other, Vector2):
+            return NotImplemented
+        self.x -= other.x
+        self.y -= other.y
+        return self
+
+    def __imul__(self, other):
+        if isinstance(other, Vector2):
+            self.x *= other.x
+            self.y *= other.y
+        else:
+            self.x *= other
+            self.y *= other
+        return self
+
+    def __itruediv__(self, other):
+        if isinstance(other, Vector2):
+            self.x /= other.x
+            self.y /= other.y
+        else:
+            self.x /= other
+            self.y /= other
+        return self
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+
     def __str__(self):
         return str((self.x, self.y))
+
+    def __repr__(self):
+        return "Vector2" + str((self.x, self.y))
+
+
+class Vector2Array:
+    # many Vector2s at once, stored as one (n, 2) float array
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = np.asarray(data, dtype=np.float64).reshape(-1, 2)
+
+    @staticmethod
+    def zeros(n):
+        return Vector2Array(np.zeros((n, 2)))
+
+    @staticmethod
+    def from_vectors(vectors):
+        return Vector2Array([(vector.x, vector.y) for vector in vectors])
+
+    def to_vectors(self) -> list[Vector2]:
+        return [Vector2(x, y) for x, y in self.data.tolist()]
+
+    @property
+    def x(self):
+        return self.data[:, 0]
+
+    @property
+    def y(self):
+        return self.data[:, 1]
+
+    def magnitudes(self):
+        return np.sqrt(np.einsum("ij,ij->i", self.data, self.data))
+
+    def normalize(self):
+        m = self.magnitudes()
+        return Vector2Array(np.divide(self.data, m[:, np.newaxis], out=np.zeros_like(self.data), where=m[:, np.newaxis] > 0))
+
+    def distances_squared(self, other):
+        difference = self._values(other) - self.data
+        return np.einsum("ij,ij->i", difference, difference)
+
+    def scaled_add(self, other, scale):
+        self.data += self._values(other) * (scale[:, np.newaxis] if np.ndim(scale) == 1 else scale)
+        return self
+
+    @staticmethod
+    def _values(other):
+        # Vector2Array, Vector2 or anything numpy broadcasts against (n, 2)
+        if isinstance(other, Vector2Array):
+            return other.data
+        if isinstance(other, Vector2):
+            return np.array((other.x, other.y))
+        return other
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            x, y = self.data[index].tolist()
+            return Vector2(x, y)
+        return Vector2Array(self.data[index])
+
+    def __setitem__(self, index, value):
+        self.data[index] = self._values(value)
+
+    def __add__(self, other):
+        return Vector2Array(self.data + self._values(other))
+
+    def __sub__(self, other):
+        return Vector2Array(self.data - self._values(other))
+
+    def __mul__(self, other):
+        if not isinstance(other, (Vector2, Vector2Array)) and np.ndim(other) == 1:
+            other = other[:, np.newaxis]
+        return Vector2Array(self.data * self._values(other))
+
+    def __iadd__(self, other):
+        self.data += self._values(other)
+        return self
+
+    def __isub__(self, other):
+        self.data -= self._values(other)
+        return self
+
+    def __imul__(self, other):
+        if not isinstance(other, (Vector2, Vector2Array)) and np.ndim(other) == 1:
+            other = other[:, np.newaxis]
+        self.data *= self._values(other)
+        return self
@@ -0,0 +1,87 @@
+import numpy as np
+
+from BlockTimestep import BlockTimestepper
+from Gravity import direct_accelerations
+from Integrator import Leapfrog
+from SimulationEngine import SimulationEngine, BINARY
+
+STEPS = 20
+TIME_STEP = 1.0
+FINE_STEPS = 1024  # uniform leapfrog steps per block step for the reference run
+
+
+def hierarchical_system():
+    # a central mass with one tight and three wide circular orbits, with the 1/r force every circular speed is 1
+    radii = np.array([1.0, 50.0, 80.0, 120.0])
+    angles = np.array([0.0, 1.0, 2.0, 3.0])
+    pos = np.vstack(([0.0, 0.0], np.column_stack((radii * np.cos(angles), radii * np.sin(angles)))))
+    vel = np.vstack(([0.0, 0.0], np.column_stack((-np.sin(angles), np.cos(angles)))))
+    mass = np.array([1.0, 1e-6, 1e-6, 1e-6, 1e-6])
+    return pos, vel, mass
+
+
+def block_accelerations(mass):
+    return lambda pos, targets: direct_accelerations(pos, mass, 1.0, targets)
+
+
+def test_matches_a_fine_uniform_leapfrog_run():
+    pos, vel, mass = hierarchical_system()
+    stepper = BlockTimestepper()
+    for _ in range(STEPS):
+        stepper.step(pos, vel, TIME_STEP, block_accelerations(mass))
+
+    reference_pos, reference_vel, _ = hierarchical_system()
+    leapfrog = Leapfrog()
+    for _ in range(STEPS * FINE_STEPS):
+        leapfrog.step(reference_pos, reference_vel, TIME_STEP / FINE_STEPS, lambda p: direct_accelerations(p, mass, 1.0))
+
+    np.testing.assert_allclose(pos, reference_pos, atol=1e-3)
+    np.testing.assert_allclose(vel, reference_vel, atol=1e-3)
+    # the wide orbits take far fewer steps than the tight one
+    assert stepper.levels[1] > stepper.levels[2:].max()
+    uniform_evaluations = STEPS * len(pos) * (1 << int(stepper.levels.max()))
+    assert stepper.force_evaluations < uniform_evaluations / 4
+
+
+def test_a_step_on_level_zero_is_one_leapfrog_step():
+    pos, vel, mass = hierarchical_system()
+    # only the wide orbits, with a small enough step they all stay on the coarsest level
+    pos, vel, mass = pos[[0, 2, 3, 4]], vel[[0, 2, 3, 4]], mass[[0, 2, 3, 4]]
+    stepper = BlockTimestepper()
+    stepper.step(pos, vel, 0.01, block_accelerations(mass))
+    assert not stepper.levels.any()
+
+    reference_pos, reference_vel = pos.copy(), vel.copy()
+    Leapfrog().step(reference_pos, reference_vel, 0.01, lambda p: direct_accelerations(p, mass, 1.0))
+    evaluations = stepper.force_evaluations
+    stepper.step(pos, vel, 0.01, block_accelerations(mass))
+    assert stepper.force_evaluations - evaluations == len(pos)
+    np.testing.assert_array_equal(pos, reference_pos)
+    np.testing.assert_array_equal(vel, reference_vel)
+
+
+def test_moved_bodies_are_not_kicked_with_stale_accelerations():
+    pos, vel, mass = hierarchical_system()
+    stepper = BlockTimestepper()
+    stepper.step(pos, vel, TIME_STEP, block_accelerations(mass))
+    # something else moves the bodies, e.g. the plain integrator while block timesteps were off
+    leapfrog = Leapfrog()
+    for _ in range(50):
+        leapfrog.step(pos, vel, 0.01, lambda p: direct_accelerations(p, mass, 1.0))
+
+    fresh_pos, fresh_vel = pos.copy(), vel.copy()
+    BlockTimestepper().step(fresh_pos, fresh_vel, TIME_STEP, block_accelerations(mass))
+    stepper.step(pos, vel, TIME_STEP, block_accelerations(mass))
+    np.testing.assert_array_equal(pos, fresh_pos)
+    np.testing.assert_array_equal(vel, fresh_vel)
+
+
+def test_toggling_block_timesteps_starts_the_stepper_over():
+    engine = SimulationEngine(scenario=BINARY)
+    engine.collisions = False
+    engine.block_timesteps = True
+    engine.advance(0.001)
+    engine.toggle_block_timesteps()
+    engine.advance(0.001)
+    engine.toggle_block_timesteps()
+    assert engine.block_stepper.acceleration is None
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from Collisions import DIRECT_LIMIT, SpatialHash
+
+
+def all_pairs(pos, radius):
+    difference = pos[:, np.newaxis, :] - pos[np.newaxis, :, :]
+    touching = np.einsum("ijk,ijk->ij", difference, difference) < (radius[:, np.newaxis] + radius) ** 2
+    return np.nonzero(np.triu(touching, 1))
+
+
+@pytest.mark.parametrize("count", [2, 5, DIRECT_LIMIT - 1, DIRECT_LIMIT, 2000])
+@pytest.mark.parametrize("sigma", [0.0, 1.0, 2.0])
+def test_matches_all_pairs(count, sigma):
+    rng = np.random.default_rng(count)
+    pos = rng.uniform(-np.sqrt(count) * 2, np.sqrt(count) * 2, (count, 2))
+    radius = rng.lognormal(0, sigma, count)
+    radius[::7] = 0
+    first, second = SpatialHash().overlapping_pairs(pos, radius)
+    expected_first, expected_second = all_pairs(pos, radius)
+    np.testing.assert_array_equal(first, expected_first)
+    np.testing.assert_array_equal(second, expected_second)
+
+
+def test_no_pairs_without_radii():
+    first, second = SpatialHash().overlapping_pairs(np.zeros((10, 2)), np.zeros(10))
+    assert len(first) == len(second) == 0
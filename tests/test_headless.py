@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import Headless
+from Snapshot import read_trajectory
+
+# 1000 cluster bodies merge within the first 20 steps when collisions are on
+ARGS = ["--scenario", "cluster", "--bodies", "1000", "--seed", "0", "--steps", "20"]
+
+
+def test_bodies_merge_without_recording(tmp_path):
+    output = tmp_path / "final.npz"
+    Headless.main(ARGS + ["--output", str(output)])
+    assert np.load(output)["pos"].shape[1] < 1000
+
+
+def test_record_every_keeps_the_body_count(tmp_path):
+    output = tmp_path / "frames.npz"
+    Headless.main(ARGS + ["--record-every", "5", "--output", str(output)])
+    frames = np.load(output)
+    assert frames["pos"].shape == (4, 1000, 2)
+    assert frames["vel"].shape == (4, 1000, 2)
+
+
+def test_trajectory_keeps_the_body_count(tmp_path):
+    output = tmp_path / "final.npz"
+    trajectory = tmp_path / "run.nbs"
+    Headless.main(ARGS + ["--record-every", "5", "--trajectory", str(trajectory), "--output", str(output)])
+    _, frames = read_trajectory(str(trajectory))
+    assert len(frames) == 4
+    assert frames["pos"].shape == (4, 1000, 2)
+    np.testing.assert_array_equal(frames["pos"][-1], np.load(output)["pos"][-1])
+
+
+def test_run_refuses_to_record_with_collisions():
+    engine = Headless.SimulationEngine(scenario=None)
+    engine.collisions = True
+    with pytest.raises(ValueError):
+        Headless.run(engine, 1, 0.01, record_every=1)
@@ -0,0 +1,20 @@
+import numpy as np
+
+from Integrator import Leapfrog
+from SimulationEngine import SimulationEngine, SOLAR
+
+
+def test_leapfrog_drops_its_acceleration_when_the_forces_change():
+    engine = SimulationEngine(scenario=SOLAR)
+    engine.collisions = False
+    engine.integrator = Leapfrog()
+    engine.step_vectorized(0.01)
+    engine.softening = 5000.0
+    pos, vel = engine.state.pos.copy(), engine.state.vel.copy()
+    engine.step_vectorized(0.01)
+
+    # the first kick has to use the softened forces too
+    accelerations = lambda p: engine.accelerations(p, engine.state.mass)
+    Leapfrog().step(pos, vel, 0.01, accelerations)
+    np.testing.assert_array_equal(engine.state.pos, pos)
+    np.testing.assert_array_equal(engine.state.vel, vel)
@@ -0,0 +1,79 @@
+import numpy as np
+
+from Path import AsyncCelestialPath, CelestialPath, PredictionRequest
+from Scenario import PLUMMER, generate
+from SimulationEngine import SimulationEngine, SOLAR
+
+
+def solar_engine():
+    engine = SimulationEngine(scenario=SOLAR)
+    engine.collisions = False
+    return engine
+
+
+def request(engine, path):
+    return PredictionRequest(engine, None, path.get_cache_key(engine, None))
+
+
+def ordered(prediction):
+    # the predicted steps in time order, out of the ring buffer
+    return np.roll(prediction.trajectory, -prediction.head, axis=0)
+
+
+def test_advancing_matches_a_longer_prediction():
+    engine = solar_engine()
+    path = CelestialPath()
+    path.num_steps = 300
+    first = ordered(path.update(request(engine, path))).copy()
+    longer = CelestialPath()
+    longer.num_steps = 400
+    reference = ordered(longer.update(request(engine, longer)))
+
+    # the engine moves on by 100 prediction steps, the ring buffer drops them and predicts 100 more
+    engine.sim_time += 100 * path.time_step + path.time_step / 2
+    advanced = path.update(request(engine, path))
+    assert advanced.head == 100
+    np.testing.assert_array_equal(ordered(advanced)[:200], first[100:])
+    np.testing.assert_allclose(ordered(advanced), reference[100:], rtol=1e-12, atol=1e-9)
+
+
+def test_horizon_is_capped_for_big_systems():
+    engine = SimulationEngine(scenario=None)
+    generate(engine, PLUMMER, count=500, seed=0)
+    path = CelestialPath(max_points=5000)
+    path.num_steps = 100000
+    prediction = path.update(request(engine, path))
+    assert prediction.trajectory.shape == (10, 500, 2)
+    assert len(prediction.get_paths(engine)) == 500
+
+
+def test_worker_process_matches_the_synchronous_prediction():
+    engine = solar_engine()
+    worker = AsyncCelestialPath(num_steps=500)
+    try:
+        worker.get_paths(engine, False)
+        assert worker.wait(60)
+        paths = worker.get_paths(engine, False)
+    finally:
+        worker.close()
+    path = CelestialPath()
+    path.num_steps = 500
+    expected = path.get_paths(engine, False)
+    assert len(paths) == len(expected) == len(engine.bodies)
+    for got, wanted in zip(paths, expected):
+        np.testing.assert_array_equal(got.array, wanted.array)
+
+
+def test_rebuild_publishes_growing_partial_predictions():
+    engine = solar_engine()
+    path = CelestialPath()
+    path.num_steps = 500
+    path.publish_every = 100
+    partial = []
+    final = path.update(request(engine, path), published=lambda prediction: partial.append(
+        [path.array for path in prediction.get_paths(engine)]))
+    assert len(partial) == 4
+    finished = [path.array for path in final.get_paths(engine)]
+    for count, paths in enumerate(partial, 1):
+        for points, full in zip(paths, finished):
+            np.testing.assert_array_equal(points, full[:100 * count])